@@ -0,0 +1,193 @@
+"""
+Export gSTAR job events from the Stats database into monthly Parquet files, for offline analytics and reports
+(generateReport.py <quarter> <year> parquet) that don't query job_event. New months are added incrementally
+Usage:
+    python3 archiveStats.py
+    OR
+    python3 archiveStats.py --directory /data/gstar_archive
+    OR, to export given months again, e.g. after log files of those months were ingested late
+    python3 archiveStats.py --month 2017-07 --month 2017-08
+"""
+import argparse
+import datetime
+import glob
+import os
+
+import mysql.connector
+import pandas as pd
+
+import statsConfig
+from migrateDB import monthStart
+from statsToDB import JOB_EVENT_COLUMNS, MOAB_CLUSTER
+
+
+# Default directory of the monthly Parquet files
+ARCHIVE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'archive')
+
+# Archived job_event columns, as Parquet column names
+ARCHIVE_COLUMNS = [column.strip('`') for column in JOB_EVENT_COLUMNS.split(',')]
+
+# DATETIME columns of job_event
+ARCHIVE_TIME_COLUMNS = ['time', 'submit_time', 'start_time', 'end_time', 'eligible_time']
+
+
+def monthFile(directory, month):
+    """
+    :param directory: archive directory
+    :param month: any date in the month
+    :return: path of the Parquet file of the job events of the month
+    """
+    return os.path.join(directory, 'job_event-{0:%Y-%m}.parquet'.format(month))
+
+
+def archivedMonths(directory):
+    """
+    :param directory: archive directory
+    :return: sorted list of first days of the months archived
+    """
+    months = []
+    for filepath in glob.glob(os.path.join(directory, 'job_event-*.parquet')):
+        months.append(datetime.datetime.strptime(os.path.basename(filepath), 'job_event-%Y-%m.parquet').date())
+
+    return sorted(months)
+
+
+def readArchive(directory, startdate, enddate, columns=None):
+    """
+    Read the JOBEND events of a period from the monthly Parquet files, as the report queries select them from job_event
+
+    :param directory: archive directory
+    :param startdate: first day of the period
+    :param enddate: last day of the period
+    :param columns: job_event columns to read, all if None
+    :return: DataFrame of job events
+    :raise FileNotFoundError: if a month of the period is not archived, as its usage would be missing
+    """
+    start = pd.Timestamp(startdate)
+    end = pd.Timestamp(enddate) + pd.Timedelta(days=1)
+
+    if columns is not None:
+        columns = sorted(set(columns) | {'time', 'type'}, key=ARCHIVE_COLUMNS.index)
+
+    filepaths = []
+    month = monthStart(start.date())
+    while month < end.date():
+        filepaths.append(monthFile(directory, month))
+        month = monthStart(month, 1)
+
+    missing = [filepath for filepath in filepaths if not os.path.exists(filepath)]
+    if missing:
+        raise FileNotFoundError('months not archived, run archiveStats.py --month: {0}'.format(', '.join(missing)))
+
+    frames = [pd.read_parquet(filepath, columns=columns) for filepath in filepaths]
+
+    if not frames:
+        return pd.DataFrame(columns=columns or ARCHIVE_COLUMNS)
+
+    events = pd.concat(frames, ignore_index=True)
+    return events[(events.type == 'JOBEND') & (events.time >= start) & (events.time < end)]
+
+
+class Archive(object):
+    """
+    Enclose all operations to export job_event into monthly Parquet files
+
+    """
+    def __init__(self, dbconfig, directory=ARCHIVE_DIR):
+        """
+        :param dbconfig: db connection dictionary
+        :param directory: archive directory, created if needed
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.con = mysql.connector.connect(**dbconfig['mysql'])
+        self.cursor = self.con.cursor()
+        print('connected')
+
+    def sync(self, months=None):
+        """
+        Export the months of job events not archived yet. The latest archived month is exported again,
+        as it may have been archived before all of its logs were ingested; earlier months are final
+
+        :param months: first days of the months to export instead, whether archived or not
+        :return: list of first days of the months exported
+        """
+        if months is None:
+            self.cursor.execute("SELECT MIN(`time`), MAX(`time`) FROM job_event WHERE cluster = %s", (MOAB_CLUSTER,))
+            first, last = self.cursor.fetchone()
+            if first is None:
+                print('job_event is empty')
+                return []
+
+            archived = archivedMonths(self.directory)
+            latest = archived[-1] if archived else None
+
+            months = []
+            month = monthStart(first)
+            while month <= last.date():
+                if month not in archived or month >= latest:
+                    months.append(month)
+                month = monthStart(month, 1)
+
+        for month in months:
+            self.exportMonth(month)
+
+        return months
+
+    def exportMonth(self, month):
+        """
+        Write all gSTAR job events of a month to its Parquet file, replacing the file once complete
+
+        :param month: first day of the month
+        :return: no of job events written
+        """
+        selectMonthStatement = (
+            "SELECT " + JOB_EVENT_COLUMNS + " FROM job_event "
+            "WHERE cluster = %s AND `time` >= %s AND `time` < %s ORDER BY `time`"
+        )
+        self.cursor.execute(selectMonthStatement, (MOAB_CLUSTER, month, monthStart(month, 1)))
+        events = pd.DataFrame(self.cursor.fetchall(), columns=ARCHIVE_COLUMNS)
+
+        if events.empty:
+            print('{0:%Y-%m}: no job events'.format(month))
+            return 0
+
+        for column in ARCHIVE_TIME_COLUMNS:
+            events[column] = pd.to_datetime(events[column])
+        events['service_units'] = events.service_units.astype('float64')
+
+        filepath = monthFile(self.directory, month)
+        events.to_parquet(filepath + '.tmp', index=False)
+        os.replace(filepath + '.tmp', filepath)
+
+        print('{0:%Y-%m}: {1} job events archived'.format(month, len(events)))
+        return len(events)
+
+    def finalize(self):
+        """
+        Close database connection
+        :return: None
+        """
+        self.cursor.close()
+        self.con.close()
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Export gSTAR job events into monthly Parquet files')
+    parser.add_argument('--directory', default=ARCHIVE_DIR,
+                        help='directory of the Parquet files (default {0})'.format(ARCHIVE_DIR))
+    parser.add_argument('--month', action='append', default=None,
+                        type=lambda month: datetime.datetime.strptime(month, '%Y-%m').date(),
+                        help='month to export again, as YYYY-MM. May be repeated')
+    args = parser.parse_args()
+
+    archive = Archive(statsConfig.readdbconfig('db_config.ini'), args.directory)
+
+    try:
+        archive.sync(args.month)
+    finally:
+        archive.finalize()
+
+    print("Done")
@@ -0,0 +1,175 @@
+"""
+Micro-benchmark of Moab event log parsing, reports the per-line cost of each parse step without touching the database.
+Also checks the pandas parser backend produces exactly the same rows as the Job class, exits with status 1 if not,
+and measures wall time of parsing the file split in ranges by 1, 2, 4... worker processes.
+Ingest into the database is measured end to end on a new SQLite database (see storage.py), so runs are reproducible without a MySQL server
+Usage:
+    python3 benchmarkStats.py <events file>
+    OR
+    python3 benchmarkStats.py <events file> <repeat>
+    OR
+    python3 benchmarkStats.py <events file> <repeat> <max workers>
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+import statsToDB
+from statsToDB import Job, LogReader, Stats, jobEvents, parseRange, splitRanges, PARSERS
+
+
+def readLines(filepath):
+    """
+    Read log file into memory, so that disk access is not measured
+    :param filepath: Log file path
+    :return: list of stripped non-blank lines
+    """
+    return [l for offset, l in LogReader(filepath)]
+
+
+def timePerLine(func, lines, repeat):
+    """
+    Best time of repeat runs of func over all lines
+    :return: microseconds per line
+    """
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    return best * 1e6 / len(lines)
+
+
+def benchmarkJob(lines, repeat):
+    """
+    Per-line cost of building Job objects, with and without memoized timestamp formatting
+    :return: list of (step, microseconds per line) tuples
+    """
+    results = []
+
+    split = [l.split() for l in lines]
+    results.append(("str.split", timePerLine(lambda: [l.split() for l in lines], lines, repeat)))
+
+    # uncached formatting, as every Job used to call time.strftime for each of its five timestamps
+    cached = statsToDB.formatTime
+    statsToDB.formatTime = cached.__wrapped__
+    try:
+        results.append(("Job, uncached timestamps", timePerLine(lambda: [Job(f) for f in split], lines, repeat)))
+    finally:
+        statsToDB.formatTime = cached
+
+    cached.cache_clear()
+    results.append(("Job, memoized timestamps", timePerLine(lambda: [Job(f) for f in split], lines, repeat)))
+    jobs = [job for job in (Job(f) for f in split) if job.complete]
+    results.append(("Job.toRow, JOBEND jobs only", timePerLine(lambda: [job.toRow() for job in jobs], lines, repeat)))
+
+    return results
+
+
+def benchmarkPipeline(filepath, lines, repeat):
+    """
+    Per-line cost of the whole parse pipeline reading from file, as run by Stats.parseFile
+    :return: list of (step, microseconds per line) tuples
+    """
+    pipeline = lambda: [job.toRow() for offset, job in jobEvents(LogReader(filepath))]
+    return [("read + filter + decode pipeline", timePerLine(pipeline, lines, repeat))]
+
+
+def compareParsers(filepath, repeat):
+    """
+    Parse whole file with every parser backend, compare the rows and measure throughput
+    :return: (True if all backends produced the same rows, list of (parser, lines per second) tuples)
+    """
+    lines = readLines(filepath)
+    rows = {}
+    throughput = []
+
+    for parser in PARSERS:
+        rows[parser] = parseRange((filepath, 0, None), parser=parser)[1]
+        best = min(timeit.repeat(lambda: parseRange((filepath, 0, None), parser=parser), number=1, repeat=repeat))
+        throughput.append((parser, len(lines) / best))
+
+    reference = rows[PARSERS[0]]
+    for parser in PARSERS[1:]:
+        for (expected, actual) in zip(reference, rows[parser]):
+            if expected != actual:
+                print("{0} parser mismatch:\n  {1}\n  {2}".format(parser, expected, actual))
+                break
+        if len(reference) != len(rows[parser]):
+            print("{0} parser returned {1} rows instead of {2}".format(parser, len(rows[parser]), len(reference)))
+
+    return all(rows[parser] == reference for parser in PARSERS), throughput
+
+
+def scaleRanges(filepath, repeat, maxworkers):
+    """
+    Wall time of parsing the file split in ranges with growing no of worker processes, as Stats.parseParallel does.
+    The file is split in a few ranges per worker, so that even a small file shows the scaling
+
+    :return: list of (no of workers, seconds) tuples
+    """
+    results = []
+
+    workers = 1
+    while workers <= maxworkers:
+        ranges = splitRanges(filepath, 0, rangesize=max(1, os.path.getsize(filepath) // (workers * 4)))
+        with multiprocessing.Pool(workers) as pool:
+            best = min(timeit.repeat(lambda: list(pool.imap_unordered(parseRange, ranges)), number=1, repeat=repeat))
+        results.append((workers, best))
+        workers *= 2
+
+    return results
+
+
+def benchmarkIngest(filepath, repeat):
+    """
+    Wall time of ingesting the file with Stats.parseStats, into a new SQLite database each run.
+    Also checks the usage_daily rollup counts every stored job event once
+
+    :return: (True if the rollup matches job_event, seconds, no of job events stored)
+    """
+    times = []
+    consistent = True
+
+    for i in range(repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'stats.sqlite')
+            stats = Stats(filepath, {'mysql': {'backend': 'sqlite', 'database': database}, 'admins': []})
+
+            start = timeit.default_timer()
+            stats.parseStats()
+            times.append(timeit.default_timer() - start)
+
+            con = sqlite3.connect(database)
+            events = con.execute("SELECT count(*) FROM job_event").fetchone()[0]
+            rolledup = con.execute("SELECT coalesce(sum(jobs), 0) FROM usage_daily").fetchone()[0]
+            con.close()
+            consistent = consistent and events == rolledup
+
+    return consistent, min(times), events
+
+
+if __name__=='__main__':
+
+    filepath = sys.argv[1]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    maxworkers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+
+    lines = readLines(filepath)
+    print("{0} lines in {1}".format(len(lines), filepath))
+
+    for (step, usec) in benchmarkJob(lines, repeat) + benchmarkPipeline(filepath, lines, repeat):
+        print("{0:40s} {1:8.2f} us/line".format(step, usec))
+
+    equivalent, throughput = compareParsers(filepath, repeat)
+    for (parser, linespersec) in throughput:
+        print("{0:40s} {1:10,.0f} lines/sec".format(parser + " parser", linespersec))
+
+    for (workers, seconds) in scaleRanges(filepath, repeat, maxworkers):
+        print("{0:40s} {1:8.3f} s".format("{0} workers, file split in ranges".format(workers), seconds))
+
+    consistent, seconds, events = benchmarkIngest(filepath, repeat)
+    print("{0:40s} {1:8.3f} s, {2:,.0f} lines/sec".format("SQLite ingest, {0} job events".format(events), seconds, len(lines) / seconds))
+
+    print("Parsers produce identical rows" if equivalent else "Parsers differ")
+    print("usage_daily rollup matches job_event" if consistent else "usage_daily rollup differs from job_event")
+    sys.exit(0 if equivalent and consistent else 1)
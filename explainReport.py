@@ -0,0 +1,105 @@
+"""
+Check that every Moab report query reads job_event/usage_daily through an index instead of a full table scan.
+Runs EXPLAIN on the exact statements the Report methods execute, exits with status 1 if any query scans a usage table
+Usage:
+    python3 explainReport.py <quarter start date> <quarter end date>
+    python3 explainReport.py 2017-07-01 2017-09-30
+    OR, for the usage_daily rollup
+    python3 explainReport.py 2017-07-01 2017-09-30 rollup
+"""
+import sys
+
+from reportFromDB import Report, USAGE_SOURCES
+from statsConfig import readdbconfig
+
+
+# Report methods querying Moab usage
+REPORT_QUERIES = ('getTotalUsage', 'getProjectUsage', 'getProjectUsagePercent', 'getInstitutionUsagePercent',
+                  'getAccountHolders', 'getActiveUsernames', 'getAusUsersUsage', 'getUsageByDemographic')
+
+
+class ExplainCursor(object):
+    """
+    Stands in for a Report cursor: runs EXPLAIN of each statement instead of the statement, and returns no rows,
+    with the columns of the statement for methods building data frames from them
+
+    """
+    def __init__(self, cursor):
+        """
+        :param cursor: database cursor EXPLAIN statements are run with
+        """
+        self.cursor = cursor
+        self.plans = []
+        self.column_names = ()
+
+    def execute(self, statement, params=None):
+        self.cursor.execute('EXPLAIN ' + statement, params)
+        columns = self.cursor.column_names
+        self.plans.append([dict(zip(columns, row)) for row in self.cursor.fetchall()])
+
+        self.cursor.execute('SELECT * FROM (' + statement + ') AS explained LIMIT 0', params)
+        self.cursor.fetchall()
+        self.column_names = self.cursor.column_names
+
+    def fetchone(self):
+        return (0,)
+
+    def fetchall(self):
+        return []
+
+    def __iter__(self):
+        return iter([])
+
+
+def fullScans(plan, tables):
+    """
+    Steps of an EXPLAIN plan reading a whole table
+
+    :param plan: list of EXPLAIN rows as dictionaries
+    :param tables: names of the tables that must not be scanned
+    :return: list of (table, access type) tuples
+    """
+    return [(step['table'], step['type']) for step in plan if step['table'] in tables and step['type'] in ('ALL', 'index')]
+
+
+def explainReport(report):
+    """
+    EXPLAIN every Moab usage query of a report
+
+    :param report: Report object
+    :return: list of (method, list of EXPLAIN rows) tuples
+    """
+    cursor = report.cursor
+    results = []
+
+    try:
+        for method in REPORT_QUERIES:
+            report.cursor = ExplainCursor(cursor)
+            getattr(report, method)()
+            for plan in report.cursor.plans:
+                results.append((method, plan))
+    finally:
+        report.cursor = cursor
+
+    return results
+
+
+if __name__=='__main__':
+
+    startdate, enddate = sys.argv[1], sys.argv[2]
+    source = sys.argv[3] if len(sys.argv) > 3 else 'events'
+    table = USAGE_SOURCES[source]['table']
+
+    report = Report(readdbconfig('db_config.ini'), startdate, enddate, source=source)
+
+    scans = 0
+    for method, plan in explainReport(report):
+        scanned = fullScans(plan, (table,))
+        keys = [str(step['key']) for step in plan if step['table'] == table]
+        print("{0:35s} {1}".format(method, 'FULL SCAN ' + str(scanned) if scanned else 'key ' + ', '.join(keys)))
+        scans += 1 if scanned else 0
+
+    report.finalize()
+
+    print("All report queries use an index" if not scans else "{0} report queries scan {1}".format(scans, table))
+    sys.exit(0 if not scans else 1)
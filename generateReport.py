@@ -7,24 +7,40 @@ Report list gSTAR and TAO stats
 Usage:
     python3 generateReport.py <quarter> <year>
     python3 generateReport.py 3 2017
+    python3 generateReport.py 3 2017 rollup
+    python3 generateReport.py 3 2017 events nocache
+    python3 generateReport.py 3 2017 nocache
     
     if not specified current date will be used to determine last reporting period/quarter
+    rollup reads Moab usage from the usage_daily table instead of every job event, parquet from the files of archiveStats.py
+    query results are cached in cache/ across runs until the data changes, nocache always queries the databases
 
 """
 
-import sys
+import argparse
 import datetime
 
 from pylatex import Document, Section, Subsection, LongTabu, Command
 from pylatex.utils import bold, NoEscape
 
 
-from reportFromDB import Report, MALE, FEMALE, ASTRONOMY, STUDENT
+from reportCache import ReportCache
+from reportExecutor import ReportExecutor, DEFAULT_REPORT_WORKERS
+from reportFromDB import Report, GSTAR_SYSTEM, OZSTAR_SYSTEM, USAGE_SOURCES, ARCHIVE_SOURCE
 from taoreportfromdb import TAOreport
 
 from statsConfig import readdbconfig
 
 
+# Rows of the account holders table of each cluster, as (label, Report.getAccountHolders row) tuples.
+# On OzSTAR, All is the astronomy account holders
+GSTAR_ACCOUNT_ROWS = [("All", "All"), ("Male", "Male"), ("Female", "Female"), ("PhD Student", "PhD Student"), ("Swinburne", "Swinburne")]
+OZSTAR_ACCOUNT_ROWS = [("All", "Astronomy"), ("Male", "Male"), ("Female", "Female"), ("PhD Student", "PhD Student"), ("Swinburne", "Swinburne")]
+
+# TAO stats sections, as (result name, TAOreport method) tuples
+TAO_SECTIONS = [('taojobs', 'getnoofjobs'), ('taoactiveusers', 'getactiveusers'), ('taodatasize', 'getdatasize'),
+                ('taoregisteredusers', 'getregisteredusers'), ('taojobsbydatabase', 'getjobsbydatabase')]
+
 
 class ReportFormat(object):
 
@@ -45,109 +61,54 @@ class ReportFormat(object):
             raise exp
 
 
-    def generateReport(self, report, taoreport):
+    def generateReport(self, report, taoreport, workers=DEFAULT_REPORT_WORKERS):
         try:
             myfilename = "latex_files/" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
+            print("Extracting report data ...")
+            results = ReportExecutor(workers).run([
+                ('institutionusage', report, 'getInstitutionUsagePercent', ()),
+                ('accountholders', report, 'getAccountHolders', (GSTAR_SYSTEM,)),
+                ('institutionastronomers', report, 'getInstitutionAstronomers', ()),
+                ('projectusage', report, 'getProjectUsagePercent', ()),
+                ('demographic', report, 'getUsageByDemographic', ()),
+            ] + [(name, taoreport, method, ()) for (name, method) in TAO_SECTIONS])
+
             print("Extracting percentage of usage by institution ...")
             self.doc.append(Section("Usage by Institution "))
             self.formatTable(header=["Institution", "Usage"], indent="X[l] X[r]",
-                             data=report.getInstitutionUsagePercent())
+                             data=results['institutionusage'])
 
             print("Extracting astronomy account holders information...")
             self.doc.append(Section("Astronomy account holders(total/active for quarter): "))
 
             # Creating a list of tuples to add to table
-            accounts_data = []
-
-            users = report.getUsersCount()
-            activeusers = report.getActiveUsersCount()
-            astronomymales = report.getUsersCount([
-                ('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', MALE)])
-            activeastronomymales = report.getActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', MALE)])
-            astronomyfemales = report.getUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', FEMALE)])
-            activeastronomyfemales = report.getActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', FEMALE)])
-            astronomystudents = report.getUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.is_student', STUDENT)])
-            activeastronomystudents = report.getActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.is_student', STUDENT)])
-            swinastro = report.getSwinAstronomersCount()
-            activeswinastro = report.getActiveSwinAstronomersCount()
-
-            accounts_data.append(("All", users, activeusers))
-            accounts_data.append(("Male", astronomymales, activeastronomymales))
-            accounts_data.append(("Female", astronomyfemales, activeastronomyfemales))
-            accounts_data.append(("PhD Student", astronomystudents, activeastronomystudents))
-            accounts_data.append(("Swinburne", swinastro, activeswinastro))
+            accounts_data = self.accountHoldersData(results['accountholders'], GSTAR_ACCOUNT_ROWS)
 
             self.formatTable(header=["", "Total", "Active"], indent="X[l] X[r] X[r]", data=accounts_data)
 
             print("Extracting no of astronomy users in all institutions...")
             self.doc.append(Section("Institutions other than Swinburne with astronomy account holders"))
             self.formatTable(header=["Institution", "No of Users"], indent="X[l] X[r]",
-                             data=report.getInstitutionAstronomers())
+                             data=results['institutionastronomers'])
 
             print("Extracting percentage of usage by project ...")
             self.doc.append(Section("Share of CPU hours usage by project"))
             self.formatTable(header=["Project", "Usage by CPU hours"], indent="X[l] X[r]",
-                             data=report.getProjectUsagePercent())
+                             data=results['projectusage'])
 
             print("Extracting percentage of usage by Demographic ...")
             self.doc.append(Section("Usage by Demographic"))
             accounts_data = []
-            demographic = report.getUsageByDemographic()
+            demographic = results['demographic']
 
             for (groups, values) in demographic.values():
                 accounts_data.append((":".join(groups), ":".join(values)))
 
             self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
 
-            #-----------------------TAO Stats---------------------------------------------------
-            # Start a new page for TAO Stats
-            self.doc.append(NoEscape(r"\newpage"))
-            self.doc.append(Section("TAO Usage Statistics"))
-
-            print("Extracting General TAO Usage ...")
-            sectiontitle = "General TAO Usage (total for {0} to {1})".format(taoreport.startdate.strftime("%d/%m/%Y"), taoreport.enddate.strftime("%d/%m/%Y"))
-            self.doc.append(Subsection(sectiontitle))
-            accounts_data = []
-            accounts_data.append(("Number of jobs", taoreport.getnoofjobs()))
-            accounts_data.append(("Number of active users", taoreport.getactiveusers()))
-
-            datasize = taoreport.getdatasize()
-
-            accounts_data.append(("Total records returned", datasize[1]))
-            accounts_data.append(("Total data-size returned", datasize[0]))
-
-            accounts_data.append(("Registered users", taoreport.getregisteredusers()))
-
-            accounts_data.append(("Page views (Google analytics)", ""))
-            accounts_data.append(("Unique users (Google analytics)", ""))
-
-            self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
-
-            print("Extracting Data access breakdown per database ...")
-            sectiontitle = "General Data access breakdown per database ({0} to {1})".format(taoreport.startdate.strftime("%d/%m/%Y"), taoreport.enddate.strftime("%d/%m/%Y"))
-            self.doc.append(Subsection(sectiontitle))
-
-            databasejobs = taoreport.getjobsbydatabase()
-            accounts_data = databasejobs.items()
-
-            self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
-
-            print("TAO site access by location from Google analytics ...")
-            sectiontitle = "TAO site access by location from Google analytics ({0} to {1})".format(taoreport.startdate.strftime("%d/%m/%Y"),
-                                                                                            taoreport.enddate.strftime("%d/%m/%Y"))
-            self.doc.append(Subsection(sectiontitle))
-
-            accounts_data = []
-            accounts_data.append(("Australia", ""))
-            accounts_data.append(("USA", ""))
-
-            self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
+            # ######## TAO STATS
+            self.addTAOStats(taoreport, results)
 
             # Generating PDF file
             self.doc.generate_pdf(myfilename, clean_tex=False)
@@ -158,7 +119,11 @@ class ReportFormat(object):
             report.finalize()
             taoreport.finalize()
 
-    def addTAOStats(self, taoreport):
+    def addTAOStats(self, taoreport, results):
+        """
+        :param taoreport: TAOreport object
+        :param results: results of TAO_SECTIONS, as returned by ReportExecutor.run
+        """
         # -----------------------TAO Stats---------------------------------------------------
         # Start a new page for TAO Stats
         self.doc.append(NoEscape(r"\newpage"))
@@ -169,15 +134,15 @@ class ReportFormat(object):
                                                                          taoreport.enddate.strftime("%d/%m/%Y"))
         self.doc.append(Subsection(sectiontitle))
         accounts_data = []
-        accounts_data.append(("Number of jobs", taoreport.getnoofjobs()))
-        accounts_data.append(("Number of active users", taoreport.getactiveusers()))
+        accounts_data.append(("Number of jobs", results['taojobs']))
+        accounts_data.append(("Number of active users", results['taoactiveusers']))
 
-        datasize = taoreport.getdatasize()
+        datasize = results['taodatasize']
 
         accounts_data.append(("Total records returned", datasize[1]))
         accounts_data.append(("Total data-size returned", datasize[0]))
 
-        accounts_data.append(("Registered users", taoreport.getregisteredusers()))
+        accounts_data.append(("Registered users", results['taoregisteredusers']))
 
         accounts_data.append(("Page views (Google analytics)", ""))
         accounts_data.append(("Unique users (Google analytics)", ""))
@@ -189,7 +154,7 @@ class ReportFormat(object):
             taoreport.startdate.strftime("%d/%m/%Y"), taoreport.enddate.strftime("%d/%m/%Y"))
         self.doc.append(Subsection(sectiontitle))
 
-        databasejobs = taoreport.getjobsbydatabase()
+        databasejobs = results['taojobsbydatabase']
         accounts_data = databasejobs.items()
 
         self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
@@ -206,60 +171,46 @@ class ReportFormat(object):
 
         self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
 
-    def generateSlurmReport(self, report, taoreport):
+    def generateSlurmReport(self, report, taoreport, workers=DEFAULT_REPORT_WORKERS):
         try:
             myfilename = "latex_files/" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
+            print("Extracting report data ...")
+            results = ReportExecutor(workers).run([
+                ('institutionusage', report, 'getSlurmInstitutionUsagePercent', ()),
+                ('accountholders', report, 'getAccountHolders', (OZSTAR_SYSTEM,)),
+                ('institutionastronomers', report, 'getOzSTARInstitutionAstronomers', ()),
+                ('projectusage', report, 'getSlurmProjectUsagePercent', ()),
+                ('demographic', report, 'getSlurmUsageByDemographic', ()),
+            ] + [(name, taoreport, method, ()) for (name, method) in TAO_SECTIONS])
+
             print("Extracting percentage of usage by institution ...")
             self.doc.append(Section("Usage by Institution "))
             self.formatTable(header=["Institution", "Usage"], indent="X[l] X[r]",
-                             data=report.getSlurmInstitutionUsagePercent())
+                             data=results['institutionusage'])
 
             print("Extracting astronomy account holders information...")
             self.doc.append(Section("Astronomy account holders(total/active for quarter): "))
 
             # Creating a list of tuples to add to table
-            accounts_data = []
-
-            astronomyusers = report.getOzSTARUsersCount([('gum_department.is_astronomy', ASTRONOMY)])
-            activeastronomyusers = report.getSlurmActiveUsersCount([('gum_department.is_astronomy', ASTRONOMY)])
-            astronomymales = report.getOzSTARUsersCount([
-                ('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', MALE)])
-            activeastronomymales = report.getSlurmActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', MALE)])
-            astronomyfemales = report.getOzSTARUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', FEMALE)])
-            activeastronomyfemales = report.getSlurmActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', FEMALE)])
-            astronomystudents = report.getOzSTARUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.is_student', STUDENT)])
-            activeastronomystudents = report.getSlurmActiveUsersCount(
-                [('gum_department.is_astronomy', ASTRONOMY), ('gum_user.is_student', STUDENT)])
-            swinastro = report.getOzSTARSwinAstronomersCount()
-            activeswinastro = report.getSlurmActiveSwinAstronomersCount()
-
-            accounts_data.append(("All", astronomyusers, activeastronomyusers))
-            accounts_data.append(("Male", astronomymales, activeastronomymales))
-            accounts_data.append(("Female", astronomyfemales, activeastronomyfemales))
-            accounts_data.append(("PhD Student", astronomystudents, activeastronomystudents))
-            accounts_data.append(("Swinburne", swinastro, activeswinastro))
+            accounts_data = self.accountHoldersData(results['accountholders'], OZSTAR_ACCOUNT_ROWS)
 
             self.formatTable(header=["", "Total", "Active"], indent="X[l] X[r] X[r]", data=accounts_data)
 
             print("Extracting no of astronomy users in all institutions...")
             self.doc.append(Section("Institutions other than Swinburne with astronomy account holders"))
             self.formatTable(header=["Institution", "No of Users"], indent="X[l] X[r]",
-                             data=report.getOzSTARInstitutionAstronomers())
+                             data=results['institutionastronomers'])
 
             print("Extracting percentage of usage by project ...")
             self.doc.append(Section("Share of CPU hours usage by project"))
             self.formatTable(header=["Project", "Percentage of Total Usage"], indent="X[l] X[r]",
-                             data=report.getSlurmProjectUsagePercent())
+                             data=results['projectusage'])
 
             print("Extracting percentage of usage by Demographic ...")
             self.doc.append(Section("Usage by Demographic"))
             accounts_data = []
-            demographic = report.getSlurmUsageByDemographic()
+            demographic = results['demographic']
 
             for groups in demographic.values():
                 grouptxt = ["{0}:  {1}%".format(group, groups[group]) for group in groups.keys()]
@@ -268,7 +219,7 @@ class ReportFormat(object):
             self.formatTable(header=[], indent="X[l] X[l]", data=accounts_data)
 
             # ######## TAO STATS
-            self.addTAOStats(taoreport)
+            self.addTAOStats(taoreport, results)
 
             # Generating PDF file
             self.doc.generate_pdf(myfilename, clean_tex=False)
@@ -281,6 +232,16 @@ class ReportFormat(object):
 
 
 
+    def accountHoldersData(self, holders, rows):
+        """
+        Rows of the account holders table to render
+
+        :param holders: DataFrame of Total and Active no of users, as returned by Report.getAccountHolders
+        :param rows: list of (label, account holders row) tuples, in rendering order
+        :return: list of (label, total, active) tuples
+        """
+        return [(label, int(holders.Total[row]), int(holders.Active[row])) for (label, row) in rows]
+
     def formatTable(self, header, data, indent):
 
         with self.doc.create(LongTabu(indent)) as data_table:
@@ -314,11 +275,9 @@ class ReportFormat(object):
             print("Extracting astronomy account holders information...")
             txtfile.write("Astronomy account holders(total/active for quarter): \n")
             txtfile.write("\n")
-            txtfile.write("All:           {0}/{1} \n".format(report.getUsersCount(), report.getActiveUsersCount()))
-            txtfile.write("Male:          {0}/{1} \n".format(report.getUsersCount([('is_astronomy', 1), ('gender', 2)]), report.getActiveUsersCount([('is_astronomy', 1), ('gender', 2)])))
-            txtfile.write("Female:        {0}/{1} \n".format(report.getUsersCount([('is_astronomy', 1), ('gender', 1)]), report.getActiveUsersCount([('is_astronomy', 1), ('gender', 1)])))
-            txtfile.write("PhD Student:   {0}/{1} \n".format(report.getUsersCount([('is_astronomy', 1), ('student', 1)]), report.getActiveUsersCount([('is_astronomy', 1), ('student', 1)])))
-            txtfile.write("Swinburne:     {0}/{1} \n".format(report.getSwinAstronomersCount(), report.getActiveSwinAstronomersCount()))
+            accounts_data = self.accountHoldersData(report.getAccountHolders(GSTAR_SYSTEM), GSTAR_ACCOUNT_ROWS)
+            for (label, users, activeusers) in accounts_data:
+                txtfile.write("{0:15s}{1}/{2} \n".format(label + ":", users, activeusers))
             txtfile.write("\n\n")
 
             print("Extracting no of astronomy users in all institutions...")
@@ -356,16 +315,38 @@ class ReportFormat(object):
 
 if __name__=='__main__':
 
+    sources = list(USAGE_SOURCES) + [ARCHIVE_SOURCE]
+
+    parser = argparse.ArgumentParser(description='Generate the quarterly report to AAL from the Stats database')
+    parser.add_argument('quarter', nargs='?', type=int, choices=[1, 2, 3, 4], help='reporting quarter, 1 starts in July')
+    parser.add_argument('year', nargs='?', type=int, help='year of the quarter, e.g. 2017')
+    parser.add_argument('options', nargs='*', metavar='{' + ','.join(sources) + ',nocache}',
+                        help='Moab usage source, one of {0} (default events), and nocache to always query the databases'.format(', '.join(sources)))
+    args = parser.parse_args()
+
+    # not choices of the argument, which an empty list of options fails on
+    for option in args.options:
+        if option not in sources and option != 'nocache':
+            parser.error('invalid option {0}, choose from {1}, nocache'.format(option, ', '.join(sources)))
+
     # calculate reporting period/quarter based on current date
 
-    if (len(sys.argv) > 1):  # if month and year were provided as arguments
-        quarter = int(sys.argv[1])
-        year = int(sys.argv[2])
+    if args.quarter is not None:  # if quarter and year were provided as arguments
+        if args.year is None:
+            parser.error('the year of the quarter is required')
+        quarter = args.quarter
+        year = args.year
     else:
         today_date = datetime.date.today()
         quarter = int(today_date.month/3) + 2
         year = today_date.year
 
+    # Moab usage from every job event, from usage_daily rollup or from Parquet files
+    source = [option for option in args.options if option in sources]
+    if len(source) > 1:
+        parser.error('more than one usage source: {0}'.format(', '.join(source)))
+    source = source[0] if source else 'events'
+
     startdate = None
     enddate = None
 
@@ -395,7 +376,8 @@ if __name__=='__main__':
     # startdate = datetime.date(2017, 7, 1)
     # enddate = datetime.date(2018, 3, 31)
     # Report(dbconfig, startdate, enddate).getProjectCollaborationStats()
-    report = Report(dbconfig, startdate, enddate)
+    cache = None if 'nocache' in args.options else ReportCache()
+    report = Report(dbconfig, startdate, enddate, source=source, cache=cache)
 
     # taorep = TAOreport(dbconfig, startdate, enddate)
     # taorep.getactiveusersdata('2016-07-01', '2017-06-30')
@@ -1,14 +1,13 @@
 import sys
 import datetime
-import pandas as pd
 
 from reportFromDB import Report
 from taoreportfromdb import TAOreport
 from statsConfig import readdbconfig
 
 from generateReport import ReportFormat
-
-from reportFromDB import Report, MALE, FEMALE, ASTRONOMY, STUDENT
+from reportCache import ReportCache
+from slurmUsage import readSlurmUsage, readSlurmEvents, OZSTAR_CLUSTER
 
 
 if __name__=='__main__':
@@ -44,8 +43,14 @@ if __name__=='__main__':
     startdate = '2019-01-01'
     enddate = '2019-03-31'
 
-    data = pd.read_csv(filename, sep="|", header=None)
-    data.columns = ['Cluster', 'Login', 'Name', 'Account', 'Used', 'Energy']
+    dbconfig = readdbconfig('db_config.ini')
+
+    # usage per user and project, without admin projects: from the utilisation file,
+    # or with `events` from the job events ingested by readSlurmStats.py
+    if 'events' in sys.argv[1:]:
+        data = readSlurmEvents(dbconfig['mysql'], OZSTAR_CLUSTER, startdate, enddate)
+    else:
+        data = readSlurmUsage(filename)
     print(data.shape)
 
     # data.set_index(['Login', 'Account'])
@@ -53,34 +58,31 @@ if __name__=='__main__':
     # print(data[data.Login =='msinha'].Used.sum())
 
 
-    dbconfig = readdbconfig('db_config.ini')
     #
     # Generating LaTex file (tex and pdf)
     # ReportFormat().generateReport(Report(dbconfig, startdate, enddate, type='slurm', slurmdata=data),
     #                               TAOreport(dbconfig, startdate, enddate))
 
+    cache = ReportCache()
+
     try:
         # myreport = Report(dbconfig, startdate, enddate, type='slurm', slurmdata=data)
         # myreport.getSlurmProjectUsagePercent()
         # print("Total usage: {0}".format(myreport.totalusage))
-        # print("OzSTAR users: {0}".format(myreport.getOzSTARUsersCount()))
-        # print("OzSTAR Swinburne Users: {0}".format(myreport.getOzSTARSwinAstronomersCount()))
-        # print("Swinburne Active users: {0}".format(myreport.getSlurmActiveSwinAstronomersCount()))
+        # print(myreport.getAccountHolders(OZSTAR_SYSTEM))
         # print("Active users count: {0}".format(len(myreport.slurmactiveusers)))
-        # print("Active astronomy males count: {0}".format(myreport.getSlurmActiveUsersCount([
-        #         ('gum_department.is_astronomy', ASTRONOMY), ('gum_user.gender', MALE)])))
 
         # print(myreport.getSlurmProjectUsagePercent())
         # print(myreport.getSlurmInstitutionUsagePercent())
         # print(myreport.getSlurmUsageByDemographic())
 
-        ReportFormat().generateSlurmReport(Report(dbconfig, startdate, enddate, type='slurm', slurmdata=data),
-                                           TAOreport(dbconfig, datetime.date(2019, 1, 1), datetime.date(2019, 3, 31)))
+        ReportFormat().generateSlurmReport(Report(dbconfig, startdate, enddate, type='slurm', slurmdata=data, cache=cache),
+                                           TAOreport(dbconfig, datetime.date(2019, 1, 1), datetime.date(2019, 3, 31), cache=cache))
 
     except Exception as exp:
         raise exp
-    # finally:
-    #     myreport.finalize()
+    finally:
+        cache.close()
 
 
 
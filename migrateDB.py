@@ -0,0 +1,227 @@
+"""
+Apply schema changes in sql/ to the gSTAR stats database, in file name order, each file once.
+Applied files are recorded in schema_migration table
+Usage:
+    python3 migrateDB.py
+    OR, to list the changes not applied yet
+    python3 migrateDB.py --list
+    OR, to record changes already applied by hand, without running them
+    python3 migrateDB.py --mark-applied 0001_processed_log_file_compressed_size.sql 0002_processed_log_file_identity.sql
+    OR, to partition job_event by month (optional). Run again every few months to add partitions ahead
+    python3 migrateDB.py --partition
+"""
+import argparse
+import datetime
+import glob
+import os
+
+import mysql.connector
+
+import statsConfig
+
+
+# Directory of schema change files, applied in name order
+SQL_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'sql')
+
+# No of monthly job_event partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = 12
+
+
+def migrationFiles():
+    """
+    Schema change files shipped in SQL_DIR
+
+    :return: sorted list of file names
+    """
+    return sorted(os.path.basename(filepath) for filepath in glob.glob(os.path.join(SQL_DIR, '*.sql')))
+
+
+def readStatements(filename):
+    """
+    Split a schema change file into statements. Files hold plain DDL/DML separated by ';' with '--' comment lines
+
+    :param filename: file name in SQL_DIR
+    :return: list of SQL statements
+    """
+    with open(os.path.join(SQL_DIR, filename)) as sqlfile:
+        lines = [line for line in sqlfile if not line.strip().startswith('--')]
+
+    return [statement.strip() for statement in ''.join(lines).split(';') if statement.strip()]
+
+
+def monthStart(day, months=0):
+    """
+    First day of the month, months after the month of day
+
+    :param day: date
+    :param months: no of months to move forward
+    :return: date
+    """
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def monthPartitions(first, last):
+    """
+    Definitions of monthly RANGE COLUMNS partitions of job_event, named pYYYYMM after the month they hold
+
+    :param first: first day of the first month
+    :param last: first day of the last month
+    :return: list of PARTITION definitions
+    """
+    partitions = []
+    month = first
+    while month <= last:
+        partitions.append("PARTITION p{0:%Y%m} VALUES LESS THAN ('{1:%Y-%m-%d}')".format(month, monthStart(month, 1)))
+        month = monthStart(month, 1)
+
+    return partitions
+
+
+class Migration(object):
+    """
+    Enclose all operations changing the gSTAR stats database schema
+
+    """
+    def __init__(self, dbconfig):
+        """
+        :param dbconfig: db connection dictionary
+        """
+        self.con = mysql.connector.connect(**dbconfig['mysql'])
+        self.cursor = self.con.cursor()
+
+        createStatement = (
+            "CREATE TABLE IF NOT EXISTS schema_migration ("
+            "name VARCHAR(255) NOT NULL PRIMARY KEY, "
+            "applied_at DATETIME NOT NULL)"
+        )
+        self.cursor.execute(createStatement)
+
+    def appliedFiles(self):
+        """
+        :return: set of names of the schema change files applied
+        """
+        self.cursor.execute("SELECT name FROM schema_migration")
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def pendingFiles(self):
+        """
+        :return: sorted list of names of the schema change files not applied yet
+        """
+        applied = self.appliedFiles()
+        return [filename for filename in migrationFiles() if filename not in applied]
+
+    def markApplied(self, filename):
+        """
+        Record a schema change file as applied
+
+        :param filename: file name in SQL_DIR
+        :return: None
+        """
+        self.cursor.execute("INSERT INTO schema_migration(name, applied_at) VALUES(%s, NOW())", (filename,))
+        self.con.commit()
+
+    def apply(self):
+        """
+        Run every pending schema change file, in name order. MySQL commits DDL statements implicitly,
+        so a file is only recorded once all of its statements succeeded; a failed file stops the migration
+
+        :return: list of names of the files applied
+        """
+        applied = []
+
+        for filename in self.pendingFiles():
+            print('applying {0}'.format(filename))
+            try:
+                for statement in readStatements(filename):
+                    self.cursor.execute(statement)
+                self.markApplied(filename)
+                applied.append(filename)
+
+            except mysql.connector.Error as err:
+                self.con.rollback()
+                print('{0} failed: {1}'.format(filename, err))
+                raise err
+
+        return applied
+
+    def partitionJobEvent(self, monthsahead=PARTITION_MONTHS_AHEAD):
+        """
+        Partition job_event by month of event time, from the month of its oldest event to monthsahead months from now,
+        plus a pmax partition catching anything later. Report queries on a quarter then only read its three partitions.
+        The primary key becomes (cluster, ID, time), as MySQL requires the partitioning column in every unique key.
+        If job_event is partitioned already, pmax is split to add the months missing up to monthsahead
+
+        :param monthsahead: no of months ahead of the current one to create partitions for
+        :return: None
+        """
+        partitionsStatement = (
+            "SELECT partition_name FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = 'job_event' AND partition_name IS NOT NULL "
+            "ORDER BY partition_ordinal_position"
+        )
+        self.cursor.execute(partitionsStatement)
+        existing = [row[0] for row in self.cursor.fetchall() if row[0] != 'pmax']
+
+        last = monthStart(datetime.date.today(), monthsahead)
+
+        if not existing:
+            self.cursor.execute("SELECT MIN(`time`) FROM job_event")
+            oldest = self.cursor.fetchone()[0] or datetime.date.today()
+            partitions = monthPartitions(monthStart(oldest), last) + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"]
+
+            partitionStatement = (
+                "ALTER TABLE job_event DROP PRIMARY KEY, ADD PRIMARY KEY (cluster, ID, `time`) "
+                "PARTITION BY RANGE COLUMNS(`time`) (" + ', '.join(partitions) + ")"
+            )
+        else:
+            newest = datetime.datetime.strptime(existing[-1], 'p%Y%m').date()
+            partitions = monthPartitions(monthStart(newest, 1), last)
+            if not partitions:
+                print('job_event partitioned up to {0:%Y-%m} already'.format(newest))
+                return
+
+            partitionStatement = (
+                "ALTER TABLE job_event REORGANIZE PARTITION pmax INTO (" +
+                ', '.join(partitions + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"]) + ")"
+            )
+
+        print('partitioning job_event up to {0:%Y-%m}'.format(last))
+        self.cursor.execute(partitionStatement)
+
+    def finalize(self):
+        """
+        Close database connection
+        :return: None
+        """
+        self.cursor.close()
+        self.con.close()
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Apply schema changes in sql/ to the gSTAR stats database')
+    parser.add_argument('--list', action='store_true', help='list the schema changes not applied yet, then exit')
+    parser.add_argument('--mark-applied', nargs='+', metavar='FILE', default=[],
+                        help='record schema change files as applied without running them, then exit')
+    parser.add_argument('--partition', action='store_true',
+                        help='partition job_event by month, or add the months missing ahead if it is already (default {0} months ahead)'.format(PARTITION_MONTHS_AHEAD))
+    args = parser.parse_args()
+
+    migration = Migration(statsConfig.readdbconfig('db_config.ini'))
+
+    try:
+        if args.list:
+            for filename in migration.pendingFiles():
+                print(filename)
+        elif args.mark_applied:
+            for filename in args.mark_applied:
+                migration.markApplied(os.path.basename(filename))
+        else:
+            migration.apply()
+            if args.partition:
+                migration.partitionJobEvent()
+    finally:
+        migration.finalize()
+
+    print("Done")
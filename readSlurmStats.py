@@ -0,0 +1,46 @@
+"""
+Entry point to read job records of a Slurm cluster, as printed by sacct -P, into the Stats database (job_event and
+usage_daily, under the cluster name), so Slurm reports can be computed per day, partition or qos as gSTAR's are.
+Records hold the fields of statsToDB.SACCT_FIELDS in that order, one per job allocation, with times in UTC:
+    TZ=UTC sacct -a -X -P -n -S 2019-01-01 -E 2019-04-01 --format=JobIDRaw,User,Group,Account,Partition,QOS,Submit,Eligible,Start,End,ElapsedRaw,State,NNodes,AllocCPUS,TimelimitRaw,ReqMem,Reservation,Constraints > sacct/ozstar_2019_q1.txt
+Files are tracked in processed_log_file as Moab logs are, so appending records and running again inserts only the new ones
+Usage:
+    python3 readSlurmStats.py 'sacct/*.txt'
+    OR, from a pipe
+    TZ=UTC sacct -a -X -P -n ... | python3 readSlurmStats.py -
+    OR
+    python3 readSlurmStats.py --cluster ozstar --batch-size 5000 --workers 4 'sacct/*.txt'
+"""
+import argparse
+import sys
+
+import statsConfig
+from slurmUsage import OZSTAR_CLUSTER
+from statsToDB import Stats, DEFAULT_BATCH_SIZE, DEFAULT_BULK_THRESHOLD, SACCT_PARSER
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Read Slurm sacct job records into the gSTAR stats database')
+    parser.add_argument('path', nargs='?', default='-', help="sacct output files, a glob pattern, or - to read stdin (default -)")
+    parser.add_argument('--cluster', default=OZSTAR_CLUSTER,
+                        help='cluster the jobs ran on, stored with them (default {0})'.format(OZSTAR_CLUSTER))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='no of job events inserted per transaction (default {0})'.format(DEFAULT_BATCH_SIZE))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='no of processes parsing files in parallel (default 1)')
+    parser.add_argument('--bulk-threshold', type=int, default=DEFAULT_BULK_THRESHOLD,
+                        help='bulk-load with LOAD DATA LOCAL INFILE when more files than this are pending (default {0})'.format(DEFAULT_BULK_THRESHOLD))
+    args = parser.parse_args()
+
+    dbconfig = statsConfig.readdbconfig('db_config.ini')
+
+    stats = Stats(args.path, dbconfig, batchsize=args.batch_size, parser=SACCT_PARSER,
+                  bulkthreshold=args.bulk_threshold, cluster=args.cluster)
+
+    if args.path == '-':
+        stats.parseStream(sys.stdin.buffer)
+    else:
+        stats.parseStats(workers=args.workers)
+
+    print("Done")
@@ -4,21 +4,77 @@ Usage:
     python3 readStats.py
     OR
     python3 readStats.py Mar 2017
+    OR
+    python3 readStats.py --batch-size 5000 Mar 2017
+    OR
+    python3 readStats.py --workers 8
+    OR
+    python3 readStats.py --parser pandas
+    OR
+    python3 readStats.py --bulk-threshold 0 Mar 2017
+    OR, once after changing the admin users list in db_config.ini, to delete their past usage
+    python3 readStats.py --purge-admins
+    OR, as a long-running service ingesting the current log file as it grows
+    python3 readStats.py --follow --interval 5
+    OR, to check new log files without database, printing JSON totals of their events and the parse speed
+    python3 readStats.py --dry-run Mar 2017
 """
-import sys
+import argparse
+import glob
+import json
+import signal
 
 import statsConfig
-from statsToDB import Stats
+from statsToDB import Stats, summarizeLogs, DEFAULT_BATCH_SIZE, DEFAULT_BULK_THRESHOLD, DEFAULT_FOLLOW_INTERVAL, PARSERS
 
 
 if __name__=='__main__':
 
+    parser = argparse.ArgumentParser(description='Read Moab event log files into the gSTAR stats database')
+    parser.add_argument('month', nargs='?', help='month of the log files to read, e.g. Mar')
+    parser.add_argument('year', nargs='?', help='year of the log files to read, e.g. 2017')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='no of job events inserted per transaction (default {0})'.format(DEFAULT_BATCH_SIZE))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='no of processes parsing log files in parallel (default 1)')
+    parser.add_argument('--parser', choices=PARSERS, default='python',
+                        help='log parser backend: Job objects line by line, or pandas C reader (default python)')
+    parser.add_argument('--bulk-threshold', type=int, default=DEFAULT_BULK_THRESHOLD,
+                        help='bulk-load with LOAD DATA LOCAL INFILE when more files than this are pending (default {0})'.format(DEFAULT_BULK_THRESHOLD))
+    parser.add_argument('--follow', action='store_true',
+                        help='keep running, ingesting new JOBEND events from the current log file as it is written')
+    parser.add_argument('--interval', type=float, default=DEFAULT_FOLLOW_INTERVAL,
+                        help='seconds between checks for new events in follow mode (default {0})'.format(DEFAULT_FOLLOW_INTERVAL))
+    parser.add_argument('--purge-admins', action='store_true',
+                        help='delete usage of the admin users listed in db_config.ini already in the database, then exit')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='parse the whole log files without connecting to database, print JSON totals, then exit')
+    args = parser.parse_args()
+
+    # also matches rotated archives, e.g. events.Mar.2017.gz, which are decompressed on the fly
     filter = 'events*'
 
-    if(len(sys.argv) > 1): #if month and year were provided as arguments
-        filter +=  sys.argv[1] + '*' + sys.argv[2] + '*' #filter = Month*Year*
+    if args.month and args.year: #if month and year were provided as arguments
+        filter +=  args.month + '*' + args.year + '*' #filter = Month*Year*
 
     path = statsConfig.read_path('config.ini') + filter
-    Stats(path, statsConfig.readdbconfig('db_config.ini')).parseStats()
+    dbconfig = statsConfig.readdbconfig('db_config.ini')
+
+    if args.dry_run:
+        summary = summarizeLogs(sorted(glob.glob(path)), frozenset(dbconfig['admins']), args.parser)
+        print(json.dumps(summary, indent=2))
+
+    else:
+        stats = Stats(path, dbconfig, batchsize=args.batch_size,
+                      parser=args.parser, bulkthreshold=args.bulk_threshold)
+
+        if args.purge_admins:
+            stats.deleteAdminUsage()
+            stats.finalize()
+        elif args.follow:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop cleanly when the service is stopped
+            stats.follow(interval=args.interval)
+        else:
+            stats.parseStats(workers=args.workers)
 
-    print("Done")
+        print("Done")
@@ -0,0 +1,162 @@
+"""
+On-disk cache of report query results, so a report of a closed quarter is rendered again without querying the databases.
+Results are stored pickled in a SQLite file, keyed by report class, method, arguments and the data version of the report:
+its period and source, plus a digest of the tables it reads. Any ingest, admin purge or user directory change gives
+a new data version, so earlier results are never returned again and are evicted, least recently used first,
+once the file outgrows its size bound
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+# Default cache file
+REPORT_CACHE_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache', 'report_cache.sqlite')
+
+# Default bound of the size of the cached results, in bytes
+REPORT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def cacheKey(*parts):
+    """
+    :param parts: values identifying a result, with a stable repr: strings, numbers, dates, tuples and lists of those
+    :return: hex digest of the values
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def tableDigest(cursor, statements, params=None):
+    """
+    Digest of the data read by a report, changing whenever the data does
+
+    :param cursor: database cursor
+    :param statements: queries returning rows that change with the data, e.g. aggregates of the report period or whole small tables
+    :param params: parameters of every statement, None if they take none
+    :return: hex digest of the rows returned
+    """
+    rows = []
+    for statement in statements:
+        cursor.execute(statement, params)
+        rows.append(cursor.fetchall())
+
+    return cacheKey(*rows)
+
+
+def cached(method):
+    """
+    Decorator of a report method, returning its result from the report's cache when the same method was called
+    with the same arguments on the same data version. The report has a cache attribute, a ReportCache or None
+    to always run the method, and a cacheVersion() method returning its data version
+
+    :param method: report method returning a picklable result
+    :return: decorated method
+    """
+    @functools.wraps(method)
+    def cachedMethod(self, *args, **kwargs):
+        if self.cache is None:
+            return method(self, *args, **kwargs)
+
+        key = cacheKey(type(self).__name__, method.__name__, args, sorted(kwargs.items()), self.cacheVersion())
+        found, result = self.cache.get(key)
+        if not found:
+            result = method(self, *args, **kwargs)
+            self.cache.put(key, result)
+
+        return result
+
+    return cachedMethod
+
+
+class ReportCache(object):
+    """
+    SQLite file of pickled results with least recently used eviction. May be shared by threads
+
+    """
+    def __init__(self, filepath=REPORT_CACHE_FILE, maxsize=REPORT_CACHE_SIZE):
+        """
+        :param filepath: cache file, created with its directory if needed
+        :param maxsize: bound of the total size of the pickled results, in bytes
+        """
+        self.maxsize = maxsize
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self.con = sqlite3.connect(filepath, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        createStatement = (
+            "CREATE TABLE IF NOT EXISTS result ("
+            "key TEXT NOT NULL PRIMARY KEY, "
+            "value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "used REAL NOT NULL)"
+        )
+        self.con.execute(createStatement)
+        self.con.execute("CREATE INDEX IF NOT EXISTS result_used ON result (used)")
+        self.con.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :param key: result key, as returned by cacheKey
+        :return: (True, result) tuple if the result is cached, (False, None) otherwise
+        """
+        with self.lock:
+            row = self.con.execute("SELECT value FROM result WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+
+            self.con.execute("UPDATE result SET used = ? WHERE key = ?", (time.time(), key))
+            self.con.commit()
+            self.hits += 1
+
+        return True, pickle.loads(row[0])
+
+    def put(self, key, result):
+        """
+        Store a result, then evict least recently used results beyond the size bound
+
+        :param key: result key, as returned by cacheKey
+        :param result: picklable result
+        :return: None
+        """
+        value = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.con.execute("INSERT OR REPLACE INTO result(key, value, size, used) VALUES(?, ?, ?, ?)",
+                             (key, value, len(value), time.time()))
+            self.evict()
+            self.con.commit()
+
+    def evict(self):
+        """
+        Delete least recently used results until the total size is within the bound. Called with the lock held
+
+        :return: no of results deleted
+        """
+        total = self.con.execute("SELECT coalesce(sum(size), 0) FROM result").fetchone()[0]
+        if total <= self.maxsize:
+            return 0
+
+        evicted = []
+        for (key, size) in self.con.execute("SELECT key, size FROM result ORDER BY used"):
+            if total <= self.maxsize:
+                break
+            evicted.append((key,))
+            total -= size
+
+        self.con.executemany("DELETE FROM result WHERE key = ?", evicted)
+        return len(evicted)
+
+    def close(self):
+        """
+        Close cache file
+        :return: None
+        """
+        print("report cache: {0} hits, {1} misses".format(self.hits, self.misses))
+        self.con.close()
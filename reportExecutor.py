@@ -0,0 +1,60 @@
+"""
+Run the queries of independent report sections concurrently, so a report takes as long as its slowest section
+instead of the sum of all of them. Every section runs in a thread on a copy of its report with its own pooled connection
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Default no of sections queried at a time, and of pooled connections per database
+DEFAULT_REPORT_WORKERS = 8
+
+# Most connections in a MySQL connection pool
+MAX_POOL_SIZE = 32
+
+
+class ReportExecutor(object):
+    """
+    Enclose running report sections on a thread pool
+
+    """
+    def __init__(self, workers=DEFAULT_REPORT_WORKERS):
+        """
+        :param workers: no of sections queried at a time
+        """
+        self.workers = max(1, min(workers, MAX_POOL_SIZE))
+
+    def run(self, sections):
+        """
+        Run report methods concurrently, each on a copy of its report returned by the report's fork method.
+        Data versions of cached reports are computed first, so copies share them
+
+        :param sections: list of (section name, Report or TAOreport object, method name, tuple of arguments) tuples
+        :return: OrderedDict of section name: method result, in the order of sections
+        """
+        counts = collections.Counter(report for (name, report, method, args) in sections)
+
+        for report, count in counts.items():
+            if report.cache is not None:
+                report.cacheVersion()
+            report.openPool(min(count, self.workers))
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [(name, pool.submit(self.runSection, report, method, args)) for (name, report, method, args) in sections]
+            return collections.OrderedDict((name, future.result()) for (name, future) in futures)
+
+    @staticmethod
+    def runSection(report, method, args):
+        """
+        Run a report method on a copy of the report with its own connection
+
+        :param report: Report or TAOreport object
+        :param method: method name
+        :param args: tuple of arguments
+        :return: method result
+        """
+        worker = report.fork()
+        try:
+            return getattr(worker, method)(*args)
+        finally:
+            worker.release()
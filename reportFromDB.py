@@ -1,9 +1,18 @@
 """
 
 """
-import mysql.connector
+import copy
+import datetime
+import threading
+
 import pandas as pd
 
+import storage
+from archiveStats import ARCHIVE_DIR, readArchive
+from statsToDB import MOAB_CLUSTER
+from reportCache import cached, cacheKey, tableDigest
+from slurmUsage import DISCARD_PROJECTS
+
 FEMALE = 1
 MALE = 0
 ASTRONOMY = 1
@@ -14,6 +23,113 @@ IS_ASTRONOMY = {1: "Astronomy", 0:"Non-astronomy"}
 IS_STUDENT = {1:"Student", 0: "Staff"}
 IS_AUSTRALIA = {'AU':"National Astronomy", '': "Other"}
 
+# gum_usersystem.system_id of each cluster
+GSTAR_SYSTEM = 1
+OZSTAR_SYSTEM = 2
+
+# gum_department.id of Swinburne astronomy
+SWINBURNE_ASTRONOMY = 6
+
+# Rows of the account holders table: current users, astronomers, astronomers by gender, astronomy students, Swinburne astronomers
+ACCOUNT_HOLDER_ROWS = ('All', 'Astronomy', 'Male', 'Female', 'PhD Student', 'Swinburne')
+
+# Tables Moab usage is read from: every job end event, or the usage_daily rollup maintained by statsToDB, gSTAR rows only.
+# table: usage table, period: predicate for the report period (start date and day after end date parameters), time: usage time column,
+# version: aggregates of the usage of the period, changing whenever it does, digested into the data version of cached results.
+# Periods are half-open ranges on the bare column, [start date, end date + 1 day), so the (cluster, type, time, ...) indexes are used.
+# Bounds are 'YYYY-mm-dd' strings computed in Python, so the same predicate runs on every storage backend
+USAGE_SOURCES = {
+    'events': {'table': 'job_event',
+               'period': "job_event.cluster = '" + MOAB_CLUSTER + "' AND job_event.type = 'JOBEND' "
+                         "AND job_event.time >= %s AND job_event.time < %s",
+               'time': 'job_event.time'},
+    'rollup': {'table': 'usage_daily',
+               'period': "usage_daily.cluster = '" + MOAB_CLUSTER + "' AND usage_daily.day >= %s AND usage_daily.day < %s",
+               'time': 'usage_daily.day'},
+}
+USAGE_SOURCES['events']['version'] = (
+    "SELECT count(*), sum(service_units), max(ID) FROM job_event WHERE " + USAGE_SOURCES['events']['period'])
+USAGE_SOURCES['rollup']['version'] = (
+    "SELECT count(*), sum(jobs), sum(service_units) FROM usage_daily WHERE " + USAGE_SOURCES['rollup']['period'])
+
+# Moab usage source read from the monthly Parquet files written by archiveStats.py instead of the database.
+# Total usage, project, institution and demographic usage are computed from the files; other sections query job_event
+ARCHIVE_SOURCE = 'parquet'
+
+# Queries digested into the data version of cached report results with the usage of the report period: user directory tables.
+# Ingest progress and job events out of the period are left out, so results of a closed quarter stay cached while logs are followed
+REPORT_VERSION_QUERIES = (
+    "SELECT * FROM gum_institution",
+    "SELECT * FROM gum_department",
+    "SELECT * FROM gum_user",
+    "SELECT * FROM gum_userdepartment",
+    "SELECT * FROM gum_usersystem",
+    "SELECT * FROM gum_project",
+    "SELECT * FROM gum_userproject",
+)
+
+# Department memberships of users on gSTAR, joined with job events for usage per institution
+INSTITUTION_MEMBERS = (
+    "SELECT distinct gum_userdepartment.department_id, gum_institution.name inst_name, "
+    "gum_department.name dept_name, gum_user.username username, "
+    "gum_userdepartment.start_date startd, gum_userdepartment.end_date endd FROM gum_userdepartment "
+    "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
+    "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
+    "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
+    "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
+    "AND gum_usersystem.system_id = 1 "
+)
+
+# Department memberships of the users of a cluster (system_id parameter) with their demographic details, for the account holders table
+ACCOUNT_HOLDER_MEMBERS = (
+    "SELECT distinct gum_user.username username, gum_userdepartment.department_id department_id, "
+    "gum_department.is_astronomy is_astronomy, gum_user.gender gender, gum_user.is_student is_student, "
+    "gum_userdepartment.end_date endd FROM gum_userdepartment "
+    "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
+    "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
+    "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
+    "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
+    "AND gum_usersystem.system_id = %s "
+)
+
+# Department memberships of the users of a cluster (system_id parameter) with their details, the user directory of Slurm reports
+USER_DIRECTORY = (
+    "SELECT distinct gum_user.id user_id, gum_user.username username, gum_user.first_name first, gum_user.last_name last, "
+    "gum_user.gender gender, gum_user.is_student is_student, gum_userdepartment.department_id department_id, "
+    "gum_department.is_astronomy is_astronomy, gum_institution.name inst_name, gum_institution.country country, "
+    "gum_userdepartment.start_date startd, gum_userdepartment.end_date endd FROM gum_userdepartment "
+    "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
+    "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
+    "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
+    "INNER JOIN gum_usersystem ON gum_usersystem.user_id = gum_user.id "
+    "AND gum_usersystem.system_id = %s "
+)
+
+# Members of gSTAR projects with the institutions of all their department memberships, for collaboration between institutions.
+# Members without department are kept, so their projects are counted
+PROJECT_MEMBERS = (
+    "SELECT gum_project.code project_code, gum_user.username username, gum_institution.name institution, "
+    "gum_institution.country country, gum_userdepartment.start_date startd, gum_userdepartment.end_date endd FROM gum_project "
+    "INNER JOIN gum_userproject ON gum_project.id = gum_userproject.project_id "
+    "INNER JOIN gum_user ON gum_userproject.user_id = gum_user.id "
+    "LEFT JOIN gum_userdepartment ON gum_userdepartment.user_id = gum_user.id "
+    "LEFT JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
+    "LEFT JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
+    "WHERE gum_project.system_id = 1 "
+)
+
+# Department memberships of all users with their demographic details, joined with job events for usage per demographic
+DEMOGRAPHIC_MEMBERS = (
+    "SELECT distinct gum_userdepartment.department_id, gum_institution.name inst_name,  gum_institution.country country, "
+    "gum_department.name dept_name, gum_department.is_astronomy is_astronomy, gum_user.username username, "
+    "gum_user.gender, gum_user.is_student is_student, gum_userdepartment.start_date startd, gum_userdepartment.end_date endd, "
+    "gum_user.first_name first, gum_user.last_name last "
+    "FROM gum_userdepartment "
+    "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
+    "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
+    "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id"
+)
+
 
 class Project(object):
 
@@ -110,7 +226,7 @@ class Report(object):
 
     """
 
-    def __init__(self, dbconfig, startdate, enddate, type='moab', slurmdata=None):
+    def __init__(self, dbconfig, startdate, enddate, type='moab', slurmdata=None, source='events', archivedir=ARCHIVE_DIR, cache=None):
 
         """
 
@@ -118,22 +234,50 @@ class Report(object):
         :param startdate: report start date, start of quarter
         :param enddate: report end date, end of quarter
         :param type: MOAB or Slurm report. default is moab
-        :param slurmdata: Dataframe contains Slurm user utilisation information per project in CPU hours.
-            needed only if it is Slurm report
+        :param slurmdata: Dataframe contains Slurm user utilisation information per project in CPU hours,
+            as returned by slurmUsage.readSlurmUsage. needed only if it is Slurm report
+        :param source: one of USAGE_SOURCES, Moab usage from job_event or from usage_daily rollup,
+            or ARCHIVE_SOURCE for Moab usage from the Parquet files in archivedir. default is events. ValueError if another
+        :param archivedir: directory of the monthly Parquet files, needed only if source is ARCHIVE_SOURCE
+        :param cache: ReportCache query results are read from and stored in, None to always query
         """
+        if source not in USAGE_SOURCES and source != ARCHIVE_SOURCE:
+            raise ValueError('unknown usage source {0}, one of {1}'.format(source, ', '.join(list(USAGE_SOURCES) + [ARCHIVE_SOURCE])))
+
         # connect to database schema using dbconfig dictionary
-        # gSTAR stats MySQL DB entry in dbconfig
+        # gSTAR stats MySQL DB entry in dbconfig, on the storage backend it sets
 
         mysqldb = dbconfig['mysql']
-        self.con = mysql.connector.connect(**mysqldb)
+        self.storage = storage.connect(mysqldb)
+        self.con = self.storage.con
         self.cursor = self.con.cursor()
+        # pool of connections of the copies of the report run by threads, see openPool
+        self.pool = None
+        # user directory and usage per login of Slurm reports, loaded on first use and shared with copies from fork
+        self.slurmtables = {}
+        self.slurmlock = threading.Lock()
         print('connected to DB')
 
         self.startdate = startdate
         self.enddate = enddate
+        self.reporttype = type
+        self.source = source
+        self.usage = USAGE_SOURCES.get(source, USAGE_SOURCES['events'])
+
+        # Cached results are only valid for the admin list they were computed with, as admin usage gets purged
+        self.cache = cache
+        self.admins = dbconfig.get('admins', [])
+        self.version = None
+        # USAGE_SOURCES period parameters
+        self.periodstart = '{0:%Y-%m-%d}'.format(pd.Timestamp(startdate))
+        self.periodend = '{0:%Y-%m-%d}'.format(pd.Timestamp(enddate) + datetime.timedelta(days=1))
+
+        # JOBEND events of the period from Parquet files, None if usage is queried from database
+        self.events = None
+        if type == 'moab' and source == ARCHIVE_SOURCE:
+            self.events = readArchive(archivedir, startdate, enddate, columns=['user', 'account', 'service_units'])
 
         # Dataframe contains Slurm user utilisation information per project in CPU hours, drop [hpc, testers, root] projects
-        discardprojects = ['hpcadmin', 'testers', 'root']
         self.slurmdata = slurmdata
 
         print("Start Date {0}, end date {1}".format(self.startdate, self.enddate))
@@ -146,20 +290,73 @@ class Report(object):
             self.usersinfo = self.getUsersInfo()
         elif type == 'slurm':
 
-            self.slurmdata = self.slurmdata[(self.slurmdata.Account.isin(discardprojects) == False)]
+            self.slurmdata = self.slurmdata[(self.slurmdata.Account.isin(DISCARD_PROJECTS) == False)]
             self.totalusage = self.gettotalusage_slurm()
             self.slurmactiveusers = self.slurmdata.Login.unique()
 
         print(self.totalusage/1000)
 
     def finalize(self):
-        # closing connection and cursor
+        # closing connection and cursor, and the pool of copies if opened
         self.cursor.close()
         self.con.close()
+        if self.pool is not None:
+            self.storage.closePool(self.pool)
+            self.pool = None
 
         print("Resources released successfully")
         print('Report generated successfully')
 
+    def openPool(self, size):
+        """
+        Open the pool of connections used by copies of the report returned by fork
+
+        :param size: no of connections, the most copies used at a time
+        :return: None
+        """
+        if self.pool is not None:
+            self.storage.closePool(self.pool)
+        self.pool = self.storage.pool(size)
+
+    def fork(self):
+        """
+        Copy of the report querying on its own connection from the pool, so queries of a thread
+        run concurrently with those of other threads. Results computed so far are shared
+
+        :return: Report object, to be released once done
+        """
+        report = copy.copy(self)
+        report.con = self.storage.getConnection(self.pool)
+        report.cursor = report.con.cursor()
+        return report
+
+    def release(self):
+        """
+        Return the connection of a report returned by fork to the pool
+        :return: None
+        """
+        self.cursor.close()
+        self.storage.putConnection(self.pool, self.con)
+
+    def cacheVersion(self):
+        """
+        Data version of the report, identifying its cached results: period, usage source, admins,
+        a digest of the usage of the period, of the user directory tables and of the usage data frames. Computed on first use
+
+        :return: hex digest
+        """
+        if self.version is None:
+            parts = [self.startdate, self.enddate, self.reporttype, self.source, self.admins,
+                     tableDigest(self.cursor, (self.usage['version'],), (self.periodstart, self.periodend)),
+                     tableDigest(self.cursor, REPORT_VERSION_QUERIES)]
+            for frame in (self.slurmdata, self.events):
+                if frame is not None:
+                    parts.append(int(pd.util.hash_pandas_object(frame).sum()))
+            self.version = cacheKey(*parts)
+
+        return self.version
+
+    @cached
     def getAllProjects(self):
         """
         Query the database for all projects
@@ -180,6 +377,7 @@ class Report(object):
 
         return projects
 
+    @cached
     def getInstitutionAstronomers(self):
         """
         Query the database for no of astronomy users group by institutions
@@ -203,27 +401,32 @@ class Report(object):
 
         return result
 
+    @cached
     def getTotalUsage(self):
         """
         Get total usage over the quarter
         :return:
         """
-        select_totalusage = "SELECT sum(service_units) from job_event WHERE type = 'JOBEND' AND DATE(time) BETWEEN DATE(%s) AND DATE(%s)"
-        self.cursor.execute(select_totalusage, (self.startdate, self.enddate))
+        if self.events is not None:
+            return self.events.service_units.sum()
+
+        select_totalusage = "SELECT sum(service_units) from {table} WHERE {period}".format(**self.usage)
+        self.cursor.execute(select_totalusage, (self.periodstart, self.periodend))
 
         return self.cursor.fetchone()[0]
 
 
+    @cached
     def getProjectUsage(self):
         """
         Query the database for total usage per project over the quarter
         :return:
         """
-        select_projectusage = "SELECT account, sum(service_units)/1000 FROM job_event "
-        select_projectusage += "WHERE type='JOBEND' AND DATE(job_event.time) BETWEEN DATE(%s) AND DATE(%s) "
+        select_projectusage = "SELECT account, sum(service_units)/1000 FROM {table} ".format(**self.usage)
+        select_projectusage += "WHERE {period} ".format(**self.usage)
         select_projectusage += "GROUP BY account ORDER BY account"
 
-        self.cursor.execute(select_projectusage, (self.startdate, self.enddate))
+        self.cursor.execute(select_projectusage, (self.periodstart, self.periodend))
 
         result = []
 
@@ -232,18 +435,22 @@ class Report(object):
 
         return "\n".join(result)
 
+    @cached
     def getProjectUsagePercent(self):
 
+        if self.events is not None:
+            return self.getArchiveProjectUsagePercent()
+
         select_projectusage = (
             "SELECT gum_project.code, a.prj_usage "
             "FROM gum_project LEFT OUTER JOIN "
-            "(SELECT account as acc, round((sum(service_units)/ %s )*100,3) as prj_usage FROM job_event "
-            "WHERE type='JOBEND' AND DATE(time) BETWEEN DATE(%s) AND DATE(%s) group by account) "
+            "(SELECT account as acc, round((sum(service_units)/ %s )*100,3) as prj_usage FROM {table} "
+            "WHERE {period} group by account) "
             "As a ON gum_project.code = a.acc "
             "WHERE gum_project.system_id = 1  "
-        )
+        ).format(**self.usage)
 
-        self.cursor.execute(select_projectusage, (self.totalusage, self.startdate, self.enddate))
+        self.cursor.execute(select_projectusage, (self.totalusage, self.periodstart, self.periodend))
 
         result = []
         for (proj, usage) in self.cursor:
@@ -251,6 +458,7 @@ class Report(object):
 
         return result
 
+    @cached
     def getUsersInfo(self):
 
         print("Getting users information")
@@ -276,59 +484,47 @@ class Report(object):
 
         return users_df
 
-    def isInternationalCollaboration(self, projectuser_df, project_code):
-        if len(projectuser_df[projectuser_df.project_code == project_code].country.unique()) > 1:
-            print('international collaboration')
-            return True
-        return False
-
-    def isMultipleAustralianInsitutions(self, projectuser_df, project_code):
-        if len(projectuser_df[((projectuser_df.project_code == project_code) & (projectuser_df.country =='AU'))].institution.unique()) > 1:
-            print("Multiple Australian Institutions")
-            return True
-        return False
-
-    def getProjectCollaborationStats(self):
-
-        ismultipleaus = 0
-        isinternational = 0
-
-        select_projectusers = (
-            "SELECT gum_userproject.id id, gum_project.code project_code, gum_user.username username FROM gum_project "
-            "INNER JOIN gum_userproject ON gum_project.id = gum_userproject.project_id "
-            "INNER JOIN gum_user ON gum_userproject.user_id = gum_user.id "
-            "WHERE gum_project.system_id = 1 "
-            "ORDER BY project_code"
-            # "WHERE gum_project.code =  %s "
-        )
-
-        self.cursor.execute(select_projectusers)
+    @cached
+    def getProjectCollaborationStats(self, periods=None):
+        """
+        Collaboration between institutions on gSTAR projects, per period: projects whose members belong
+        to institutions of several countries (international), or to several Australian institutions (multipleaus).
+        Members count for the institutions of their department memberships overlapping the period.
+        All periods are computed from a single query, so trends over many quarters cost one report
 
-        projectusers_dict = dict()
-        for (id, code, username) in self.cursor:
-            projectusers_dict[id] = (code, username)
+        :param periods: list of (start date, end date) tuples, the report period if None
+        :return: (DataFrame of international and multipleaus flags indexed by (startdate, enddate, project_code),
+            DataFrame of no of projects, of international and multipleaus projects and their percentages indexed by (startdate, enddate))
+        """
+        if periods is None:
+            periods = [(self.startdate, self.enddate)]
 
-        projectusers_df = pd.DataFrame.from_dict(data=projectusers_dict, orient='index', columns=['project_code', 'username'])
-        # print(projectusers_df)
-        project_users_merged = pd.merge(projectusers_df, self.usersinfo[['username', 'institution', 'country']], on='username')
-        # print(project_users_merged)
+        self.cursor.execute(PROJECT_MEMBERS)
+        members = pd.DataFrame(self.cursor.fetchall(), columns=self.cursor.column_names)
 
-        projects_count = len(projectusers_df['project_code'].unique())
+        # every membership against every period
+        periods = pd.DataFrame([(pd.Timestamp(start), pd.Timestamp(end)) for (start, end) in periods], columns=['startdate', 'enddate'])
+        members = pd.merge(members.assign(cross=0), periods.assign(cross=0), on='cross')
 
-        for project in project_users_merged.project_code.unique():
-            print("Project {0}: {1}/{2}". format(project, self.isInternationalCollaboration(project_users_merged, project), self.isMultipleAustralianInsitutions(project_users_merged, project)))
-            if self.isMultipleAustralianInsitutions(project_users_merged, project):
-                ismultipleaus += 1
+        startd = pd.to_datetime(members.startd)
+        endd = pd.to_datetime(members.endd)
+        current = (startd <= members.enddate) & ((endd >= members.startdate) | endd.isnull())
 
-            if self.isInternationalCollaboration(project_users_merged, project):
-                isinternational += 1
+        projects = [members.startdate, members.enddate, members.project_code]
+        countries = members.country.where(current).groupby(projects).nunique()
+        ausinstitutions = members.institution.where(current & (members.country == 'AU')).groupby(projects).nunique()
 
-        print("Total Projects: {0}".format(projects_count))
-        print('{0} Projects with Multiple Australian Institutions, Percentage {1}'.format(ismultipleaus, ismultipleaus/projects_count * 100.0))
-        print('{0} Projects with Australian and International Institutions, Percentage {1}'.format(isinternational, isinternational/projects_count * 100.0))
+        flags = pd.DataFrame({'international': countries > 1, 'multipleaus': ausinstitutions > 1},
+                             columns=['international', 'multipleaus'])
 
+        summary = flags.groupby(level=['startdate', 'enddate']).sum().astype(int)
+        summary.insert(0, 'projects', flags.groupby(level=['startdate', 'enddate']).size())
+        summary['international_percent'] = summary.international / summary.projects * 100.0
+        summary['multipleaus_percent'] = summary.multipleaus / summary.projects * 100.0
 
+        return flags, summary
 
+    @cached
     def getInstitutionUsagePercent(self):
         """
         Query the database for percentage of usage per institution over the quarter
@@ -336,25 +532,22 @@ class Report(object):
         :param totalusage:
         :return:
         """
+        if self.events is not None:
+            usage = self.getArchiveUsagePercent(INSTITUTION_MEMBERS, ['inst_name'])
+            return [(inst, str(percentage) + "%") for (inst, percentage) in usage.items()]
+
         select_institutionusage = (
             "SELECT user_inst.inst_name , round((sum(service_units)/ %s )*100,2) as percentage "
-            "FROM job_event inner join "
-            "(SELECT distinct gum_userdepartment.department_id, gum_institution.name inst_name, "
-            "gum_department.name dept_name, gum_user.username username, "
-            "gum_userdepartment.start_date startd, gum_userdepartment.end_date endd FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
-            "AND gum_usersystem.system_id = 1 "
-            ") AS user_inst ON job_event.user = user_inst.username "
-            "WHERE type='JOBEND' AND Date(job_event.time) between Date(%s) AND Date(%s) "
-            "AND job_event.time >= user_inst.startd AND (job_event.time <= user_inst.endd OR user_inst.endd IS NULL) "
+            "FROM {table} inner join "
+            "(" + INSTITUTION_MEMBERS +
+            ") AS user_inst ON {table}.user = user_inst.username "
+            "WHERE {period} "
+            "AND {time} >= user_inst.startd AND ({time} <= user_inst.endd OR user_inst.endd IS NULL) "
             "GROUP BY user_inst.inst_name "
             "ORDER BY percentage DESC"
-        )
+        ).format(**self.usage)
 
-        count = self.cursor.execute(select_institutionusage, (self.totalusage, self.startdate, self.enddate))
+        count = self.cursor.execute(select_institutionusage, (self.totalusage, self.periodstart, self.periodend))
 
         result = []
         for (inst, usage) in self.cursor:
@@ -362,103 +555,64 @@ class Report(object):
 
         return result
 
-    def getUsersCount(self, filters=[]):
+    @cached
+    def getAccountHolders(self, system=GSTAR_SYSTEM):
         """
-        Query the database for no of users who meet certain criteria (filter)
+        Account holders table of a cluster, in total and active over the quarter, computed from a single query
+        of department memberships. Each user is counted once per row, whatever their no of departments.
+        Swinburne counts past members of the department too
 
-        :return:
+        :param system: gum_usersystem.system_id of the cluster, GSTAR_SYSTEM or OZSTAR_SYSTEM
+        :return: DataFrame of Total and Active no of users, indexed by ACCOUNT_HOLDER_ROWS
         """
-        select_nousers = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
-            "WHERE gum_userdepartment.end_date IS NULL "
-            "AND gum_usersystem.system_id = 1 "
-        )
-
-        for i in range(len(filters)):
-            select_nousers += "AND {0} = {1} ".format(filters[i][0], filters[i][1])
+        self.cursor.execute(ACCOUNT_HOLDER_MEMBERS, (system,))
+        members = pd.DataFrame(self.cursor.fetchall(), columns=self.cursor.column_names)
 
-        self.cursor.execute(select_nousers)
+        current = members.endd.isnull()
+        astronomy = current & (members.is_astronomy == ASTRONOMY)
+        memberships = pd.DataFrame({
+            'All': current,
+            'Astronomy': astronomy,
+            'Male': astronomy & (members.gender == MALE),
+            'Female': astronomy & (members.gender == FEMALE),
+            'PhD Student': astronomy & (members.is_student == STUDENT),
+            'Swinburne': members.department_id == SWINBURNE_ASTRONOMY,
+        }, columns=ACCOUNT_HOLDER_ROWS)
 
-        nousers = 0
-        for (x) in self.cursor:
-            nousers = x[0]
+        # one row of flags per user
+        users = memberships.groupby(members.username).any()
+        active = users.index.isin(self.getActiveUsernames(system))
 
-        return nousers
+        return pd.DataFrame({'Total': users.sum(), 'Active': users[active].sum()}, columns=['Total', 'Active'])
 
-    def getActiveUsersCount(self, filters=[]):
+    @cached
+    def getActiveUsernames(self, system=GSTAR_SYSTEM):
         """
-        Query the database for no of active users over the quarter, satisfying specified filters
+        Users with usage over the quarter
 
-        :return: no of active users
+        :param system: gum_usersystem.system_id of the cluster, GSTAR_SYSTEM or OZSTAR_SYSTEM
+        :return: list of usernames
         """
-        select_noactiveusers = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
-            "WHERE gum_userdepartment.end_date IS NULL "
-            "AND gum_usersystem.system_id = 1 "
-            "AND gum_user.username in (select distinct user from job_event WHERE DATE(time) BETWEEN DATE(%s) AND DATE(%s)) "
-        )
-
-        for filter in filters:
-            select_noactiveusers += "AND {0} = {1} ".format(filter[0], filter[1])
+        if system == OZSTAR_SYSTEM:
+            return list(self.slurmactiveusers)
 
-        self.cursor.execute(select_noactiveusers, (self.startdate, self.enddate))
+        if self.events is not None:
+            return list(self.events.user.unique())
 
-        nousers = 0
-        for (x) in self.cursor:
-            nousers = x[0]
+        select_activeusers = "SELECT DISTINCT user FROM {table} WHERE {period}".format(**self.usage)
+        self.cursor.execute(select_activeusers, (self.periodstart, self.periodend))
 
-        return nousers
-
-    def getActiveSwinAstronomersCount(self):
-        """
-        Query the database for no of active astronomer users from Swinburne Uni, during the quarter
-        :return: no of active swinburne astronomers
-        """
-        select_actswinastro = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_user on gum_userdepartment.user_id=gum_user.id "
-            "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
-            "WHERE gum_userdepartment.department_id = 6 "
-            "AND gum_usersystem.system_id = 1 "
-            "AND gum_user.username IN (SELECT DISTINCT user FROM job_event WHERE DATE(time) BETWEEN DATE(%s) AND DATE(%s) ) "
-        )
-
-        self.cursor.execute(select_actswinastro, (self.startdate, self.enddate))
-
-        return self.cursor.fetchone()[0]
-
-    def getSwinAstronomersCount(self):
-        """
-        Query the database for no of all astronomer users from Swinburne Uni
-        :return:
-        """
-        select_swinastro = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_usersystem on gum_userdepartment.user_id = gum_usersystem.user_id "
-            "WHERE gum_userdepartment.department_id = 6 "
-            "AND gum_usersystem.system_id = 1 "
-        )
-
-        self.cursor.execute(select_swinastro)
-
-        return self.cursor.fetchone()[0]
+        return [username for (username,) in self.cursor]
 
+    @cached
     def getAusUsersUsage(self):
         """
 
         :return:
         """
         select_aususage = (
-            "SELECT inst_users.first, inst_users.last, inst_users.inst_name, job_event.user, "
-            "round((sum(service_units)/ %s )*100,2) AS percentage FROM job_event INNER JOIN ( " 
+            "SELECT inst_users.first, inst_users.last, inst_users.inst_name, {table}.user, "
+            "round((sum(service_units)/ %s )*100,2) AS percentage FROM {table} INNER JOIN ( " 
             "SELECT distinct gum_userdepartment.department_id, gum_institution.name inst_name, "    
             "gum_department.name dept_name, gum_user.username username, gum_user.first_name first, gum_user.last_name last, "
             "gum_userdepartment.start_date startd, gum_userdepartment.end_date endd FROM gum_userdepartment "
@@ -466,14 +620,14 @@ class Report(object):
             "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
             "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
             "WHERE gum_department.is_astronomy = 1 "
-            "AND gum_institution.country = 'AU' ) as inst_users ON job_event.user = inst_users.username "
-            "WHERE type='JOBEND' and Date(job_event.time) BETWEEN Date(%s) AND Date(%s) "
-            "AND job_event.time >= inst_users.startd AND ( job_event.time <= inst_users.endd OR inst_users.endd IS NULL) "
-            "GROUP BY job_event.user, inst_users.first, inst_users.last, inst_users.inst_name "
+            "AND gum_institution.country = 'AU' ) as inst_users ON {table}.user = inst_users.username "
+            "WHERE {period} "
+            "AND {time} >= inst_users.startd AND ( {time} <= inst_users.endd OR inst_users.endd IS NULL) "
+            "GROUP BY {table}.user, inst_users.first, inst_users.last, inst_users.inst_name "
             "ORDER BY percentage desc"
-        )
+        ).format(**self.usage)
 
-        self.cursor.execute(select_aususage, (self.totalusage, self.startdate, self.enddate,))
+        self.cursor.execute(select_aususage, (self.totalusage, self.periodstart, self.periodend,))
 
         result = []
         for (first, last, institution, username, usage) in self.cursor:
@@ -481,33 +635,32 @@ class Report(object):
 
         return "\n".join(result)
 
+    @cached
     def getUsageByDemographic(self):
         """
         Query the database for percentage of usage based on different demographic criteria; gender, is student, is astronomy, is national
         :return:
         """
         select_userusage = (
-            "SELECT inst_users.first, inst_users.last, job_event.user, inst_users.gender, inst_users.is_student, inst_users.is_astronomy, "
+            "SELECT inst_users.first, inst_users.last, {table}.user, inst_users.gender, inst_users.is_student, inst_users.is_astronomy, "
             "inst_users.inst_name, inst_users.country, round((sum(service_units)/ %s )*100,2) AS percentage "
-            "FROM job_event INNER JOIN ( "
-            "SELECT distinct gum_userdepartment.department_id, gum_institution.name inst_name,  gum_institution.country country, "
-            "gum_department.name dept_name, gum_department.is_astronomy is_astronomy, gum_user.username username, "
-            "gum_user.gender, gum_user.is_student is_student, gum_userdepartment.start_date startd, gum_userdepartment.end_date endd, "
-            "gum_user.first_name first, gum_user.last_name last "
-            "FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id) as inst_users ON job_event.user = inst_users.username "
-            "WHERE job_event.type='JOBEND' and DATE(time) BETWEEN DATE(%s) AND DATE(%s) "
-            "AND job_event.time >= inst_users.startd AND ( job_event.time <= inst_users.endd OR inst_users.endd IS NULL) "
-            "GROUP BY inst_users.first, inst_users.last, job_event.user, inst_users.gender, inst_users.is_student, inst_users.is_astronomy, inst_users.inst_name, inst_users.country "
+            "FROM {table} INNER JOIN ( " + DEMOGRAPHIC_MEMBERS +
+            ") as inst_users ON {table}.user = inst_users.username "
+            "WHERE {period} "
+            "AND {time} >= inst_users.startd AND ( {time} <= inst_users.endd OR inst_users.endd IS NULL) "
+            "GROUP BY inst_users.first, inst_users.last, {table}.user, inst_users.gender, inst_users.is_student, inst_users.is_astronomy, inst_users.inst_name, inst_users.country "
             "ORDER BY percentage desc"
-        )
+        ).format(**self.usage)
 
         users = []
-        self.cursor.execute(select_userusage, (self.totalusage, self.startdate, self.enddate,))
-        for userdata in self.cursor:
-            users.append(User(userdata))
+        if self.events is not None:
+            groups = ['first', 'last', 'username', 'gender', 'is_student', 'is_astronomy', 'inst_name', 'country']
+            for (userdata, percentage) in self.getArchiveUsagePercent(DEMOGRAPHIC_MEMBERS, groups).items():
+                users.append(User(userdata + (percentage,)))
+        else:
+            self.cursor.execute(select_userusage, (self.totalusage, self.periodstart, self.periodend,))
+            for userdata in self.cursor:
+                users.append(User(userdata))
 
         # Dictionary of (demographic criteria, list of groups and usages)
         demographic = {}
@@ -522,6 +675,42 @@ class Report(object):
 
         return demographic
 
+    def getArchiveProjectUsagePercent(self):
+        """
+        getProjectUsagePercent from Parquet files: percentage of usage per gSTAR project over the quarter
+
+        :return: list of (project code, percentage) tuples, '-' for projects without usage
+        """
+        self.cursor.execute("SELECT gum_project.code FROM gum_project WHERE gum_project.system_id = 1 ")
+        usage = (self.events.groupby('account').service_units.sum() / self.totalusage * 100).round(3)
+
+        result = []
+        for (proj,) in self.cursor:
+            result.append((proj, str(usage[proj]) + "%" if proj in usage.index else '-'))
+
+        return result
+
+    def getArchiveUsagePercent(self, members, groups):
+        """
+        Percentage of usage from Parquet files over the quarter, grouped by user department details.
+        Job events are joined with the department memberships of their user that were current at event time,
+        as getInstitutionUsagePercent and getUsageByDemographic join job_event
+
+        :param members: query of department memberships, with username, startd and endd columns
+        :param groups: membership columns to group usage by
+        :return: Series of percentages rounded to 2 decimals indexed by groups, in descending order
+        """
+        self.cursor.execute(members)
+        memberships = pd.DataFrame(self.cursor.fetchall(), columns=self.cursor.column_names)
+
+        usage = pd.merge(self.events[['user', 'time', 'service_units']], memberships, left_on='user', right_on='username')
+        startd = pd.to_datetime(usage.startd)
+        endd = pd.to_datetime(usage.endd)
+        usage = usage[(usage.time >= startd) & ((usage.time <= endd) | endd.isnull())]
+
+        percentage = (usage.groupby(groups).service_units.sum() / self.totalusage * 100).round(2)
+        return percentage.sort_values(ascending=False)
+
     def getFilteredUsage(self, usersusage, filter=""):
         """
         Group users based on specified criteria and calculates total usage for each group
@@ -573,54 +762,10 @@ class Report(object):
         return totalusage
 
 
-    def getSlurmActiveUsersCount(self, filters=[]):
-        """
-        Query the database for no of active slurm users satisfying specified filters
-
-        :return: no of active users
-        """
-
-
-        select_noactiveusers = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "WHERE gum_userdepartment.end_date IS NULL "
-            "AND gum_user.username in (%s) "
-        )
-
-        for filter in filters:
-            select_noactiveusers += "AND {0} = {1} ".format(filter[0], filter[1])
-
-        format_strings = ','.join(['%s'] * len(self.slurmactiveusers))
-        self.cursor.execute(select_noactiveusers % format_strings, tuple(self.slurmactiveusers))
-
-        # select_noactiveusers = (
-        #     "SELECT count(*) FROM gum_userdepartment "
-        #     "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-        #     "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-        #     "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-        #     "WHERE gum_userdepartment.end_date IS NULL "
-        #     "AND gum_user.username in " + str(tuple(self.slurmactiveusers)) + " "
-        # )
-        #
-        # for filter in filters:
-        #     select_noactiveusers += "AND {0} = {1} ".format(filter[0], filter[1])
-        #
-        # print(select_noactiveusers)
-        #
-        # self.cursor.execute(select_noactiveusers)
-
-        nousers = 0
-        for (x) in self.cursor:
-            nousers = x[0]
-
-        return nousers
-
+    @cached
     def getSlurmProjectUsagePercent(self):
 
-        projectusage = round(self.slurmdata.groupby(by='Account').Used.sum() * 100.0 / self.totalusage, 3)
+        projectusage = round(self.slurmdata.groupby(by='Account', observed=True).Used.sum() * 100.0 / self.totalusage, 3)
         projectusagelist = []
 
         select_ozstarprojects = "select code from gum_project where system_id = 2 and gum_project.code like 'oz%' order by code"
@@ -632,61 +777,19 @@ class Report(object):
 
         return projectusagelist
 
-    def getSlurmActiveSwinAstronomersCount(self):
-        """
-        Query the database for no of active astronomer users from Swinburne Uni, during the quarter
-        :return: no of active swinburne astronomers
-        """
-        select_actswinastro = (
-            "SELECT count(*) FROM gum_userdepartment "
-            "INNER JOIN gum_user on gum_userdepartment.user_id=gum_user.id "
-            "INNER JOIN gum_usersystem on gum_usersystem.user_id = gum_user.id "
-            "WHERE gum_userdepartment.department_id = 6 AND gum_usersystem.system_id = 2 AND gum_user.username IN (%s) "
-        )
-
-        format_strings = ','.join(['%s'] * len(self.slurmactiveusers))
-        self.cursor.execute(select_actswinastro % format_strings, tuple(self.slurmactiveusers))
-
-        return self.cursor.fetchone()[0]
-
+    @cached
     def getSlurmInstitutionUsagePercent(self):
         """
-        Query the database for percentage of usage per institution over the quarter
+        Percentage of usage per institution over the quarter. Users count for the institutions of their latest
+        current department memberships
 
-        :param totalusage:
-        :return:
+        :return: list of (institution, percentage) tuples, in descending order of usage
         """
+        users = self.getLatestMemberships(self.getSlurmUserDirectory().endd.isnull())
+        users = users[~users.index.duplicated(keep='last')]
 
-
-        select_institutionusers = (
-            "select DISTINCT ustartdate.username, gum_institution.name from gum_institution "
-            "LEFT JOIN gum_department on gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_userdepartment on gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN ( "
-            "select distinct gum_user.id uid, max(start_date) sdate, gum_user.username username "
-            "from gum_userdepartment " 
-            "INNER JOIN gum_department on gum_userdepartment.department_id  = gum_department.id "
-            "INNER JOIN gum_user on gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem ON gum_userdepartment.user_id = gum_usersystem.user_id "
-            "where gum_userdepartment.end_date is null and gum_usersystem.system_id = 2 "
-            "group by uid) as ustartdate on  ustartdate.uid = gum_userdepartment.user_id "
-            "where gum_userdepartment.start_date = ustartdate.sdate;"
-        )
-
-        userusage = self.slurmdata.groupby(by='Login').Used.sum()
-
-        self.cursor.execute(select_institutionusers)
-
-        userinst_dict = dict()
-
-        for (username, inst) in self.cursor.fetchall():
-            userinst_dict[username] = [inst, userusage[username] if username in userusage.keys() else 0]
-
-
-
-        userinst_df = pd.DataFrame.from_dict(userinst_dict, orient='index', columns=['institution', 'usage'])
-        instusage = (userinst_df.groupby(by='institution').usage.sum()).sort_values(ascending=False)
-
+        usage = self.getSlurmLoginUsage().reindex(users.index, fill_value=0)
+        instusage = usage.groupby(users.inst_name, observed=True).sum().sort_values(ascending=False)
 
         result = []
         for inst in instusage.keys():
@@ -694,34 +797,22 @@ class Report(object):
 
         return result
 
+    @cached
     def getSlurmUsageByDemographic(self):
         """
-        Query the database for percentage of usage based on different demographic criteria; gender, is student, is astronomy, is national
-        :return:
+        Percentage of usage based on different demographic criteria; gender, is student, is astronomy, is national
+        :return: dictionary of criteria: Series of percentages per group
         """
+        directory = self.getSlurmUserDirectory()
+        users = directory[~directory.index.duplicated(keep='last')]
 
-        select_userusage = (
-            "SELECT distinct gum_user.first_name first, gum_user.last_name last, gum_user.username username, "
-            "gum_user.gender, gum_user.is_student is_student, gum_department.is_astronomy is_astronomy, "
-            "gum_institution.name inst_name,  gum_institution.country country "
-            "FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem ON gum_usersystem.user_id = gum_user.id "
-            "WHERE gum_usersystem.system_id = 2 "
-        )
-
-        userusage = self.slurmdata.groupby(by='Login').Used.sum()
-
-        users = dict()
-        self.cursor.execute(select_userusage)
-        for userdata in self.cursor:
-            u = SlurmUser(userdata)
-            u.usage = userusage[u.username] if u.username in userusage.keys() else 0
-            users[u.username] = u.__dict__
-
-        users_df = pd.DataFrame.from_dict(data=users, orient='index')
+        users_df = pd.DataFrame({
+            'gender': users.gender.map(GENDER),
+            'student': users.is_student.map(IS_STUDENT),
+            'is_astronomy': users.is_astronomy.map(IS_ASTRONOMY),
+            'is_australia': (users.country == 'AU').map({True: IS_AUSTRALIA['AU'], False: IS_AUSTRALIA['']}),
+            'usage': self.getSlurmLoginUsage().reindex(users.index, fill_value=0),
+        }, index=users.index)
 
         # Dictionary of (demographic criteria, list of groups and usages)
         demographic = {}
@@ -736,117 +827,73 @@ class Report(object):
 
         return demographic
 
-    def getGroupUsage(self, usersusage, filter=""):
+    def getSlurmUserDirectory(self):
         """
-        Group users based on specified criteria and calculates total usage for each group
+        Department memberships of OzSTAR users with their details, queried once per report.
+        Typed: dates as datetime64, institution and country as categories
 
-        :param usersusage: user information and usage in a dataframe
-        :return: List of groups and corresponding usage totals
+        :return: DataFrame indexed by username, one row per membership
         """
+        with self.slurmlock:
+            if 'directory' not in self.slurmtables:
+                self.cursor.execute(USER_DIRECTORY, (OZSTAR_SYSTEM,))
+                directory = pd.DataFrame(self.cursor.fetchall(), columns=self.cursor.column_names)
 
+                directory['startd'] = pd.to_datetime(directory.startd)
+                directory['endd'] = pd.to_datetime(directory.endd)
+                directory['inst_name'] = directory.inst_name.astype('category')
+                directory['country'] = directory.country.astype('category')
 
-        groupusage = round(usersusage.groupby(by=filter).usage.sum() * 100.0 / self.totalusage, 2)
-        # print(groupusage)
+                self.slurmtables['directory'] = directory.set_index('username')
 
-        return groupusage
+        return self.slurmtables['directory']
 
-    def getOzSTARUsersCount(self, filters=[]):
+    def getSlurmLoginUsage(self):
         """
-        Query the database for no of users who meet certain criteria (filter)
-
-        :return:
+        Slurm usage per login, computed once per report
+        :return: Series of CPU hours indexed by login
         """
-        select_nousers = (
-            "SELECT count(DISTINCT gum_user.username) FROM gum_userdepartment "
-            "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_user ON gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem ON gum_usersystem.user_id = gum_user.id "
-            "WHERE gum_userdepartment.end_date IS NULL AND gum_usersystem.system_id = 2 "
-        )
+        with self.slurmlock:
+            if 'loginusage' not in self.slurmtables:
+                self.slurmtables['loginusage'] = self.slurmdata.groupby(by='Login', observed=True).Used.sum()
 
-        for i in range(len(filters)):
-            select_nousers += "AND {0} = {1} ".format(filters[i][0], filters[i][1])
+        return self.slurmtables['loginusage']
 
-        self.cursor.execute(select_nousers)
+    def getLatestMemberships(self, current):
+        """
+        Memberships of OzSTAR users starting on the latest start date of their current memberships
 
-        nousers = 0
-        for (x) in self.cursor:
-            nousers = x[0]
+        :param current: boolean Series of the user directory, memberships to take the latest start date of
+        :return: DataFrame of user directory rows
+        """
+        directory = self.getSlurmUserDirectory()
+        latest = directory[current].groupby('user_id').startd.max()
 
-        return nousers
+        return directory[directory.startd == directory.user_id.map(latest)]
 
-    def getOzSTARSwinAstronomersCount(self):
+    def getGroupUsage(self, usersusage, filter=""):
         """
-        Query the database for no of all astronomer users from Swinburne Uni
-        :return:
+        Group users based on specified criteria and calculates total usage for each group
+
+        :param usersusage: user information and usage in a dataframe
+        :return: List of groups and corresponding usage totals
         """
-        select_swinastro = (
-            "SELECT count(DISTINCT gum_userdepartment.user_id) FROM gum_userdepartment "
-            "INNER JOIN gum_usersystem ON gum_userdepartment.user_id = gum_usersystem.user_id "
-            "WHERE gum_userdepartment.department_id = 6 AND gum_usersystem.system_id = 2 "
-        )
 
-        self.cursor.execute(select_swinastro)
 
-        return self.cursor.fetchone()[0]
+        groupusage = round(usersusage.groupby(by=filter).usage.sum() * 100.0 / self.totalusage, 2)
+        # print(groupusage)
+
+        return groupusage
 
+    @cached
     def getOzSTARInstitutionAstronomers(self):
         """
-        Query the database for no of astronomy users group by institutions
-        :return:
+        No of astronomy users on OzSTAR per institution, of their latest current astronomy department memberships
+        :return: list of (institution, no of users) tuples, in descending order of users
         """
-        # select_astro = (
-        #     "SELECT DISTINCT gum_userdepartment.department_id, gum_institution.name, gum_department.name, count(gum_userdepartment.user_id) no_of_users FROM gum_userdepartment "
-        #     "INNER JOIN gum_department ON gum_userdepartment.department_id = gum_department.id "
-        #     "INNER JOIN gum_institution ON gum_department.institution_id = gum_institution.id "
-        #     "INNER JOIN gum_usersystem ON gum_userdepartment.user_id = gum_usersystem.user_id "
-        #     "WHERE gum_userdepartment.end_date IS NULL "
-        #     "AND gum_department.is_astronomy = 1 AND gum_usersystem.system_id = 2 "
-        #     "GROUP BY gum_userdepartment.department_id "
-        #     "ORDER BY no_of_users desc, gum_userdepartment.department_id"
-        # )
-
-        # result = []
-        #
-        # self.cursor.execute(select_astro)
-        # for (deptid, institution, deptname, noofusers) in self.cursor:
-        #     result.append((institution, noofusers))
-
-        select_astro = (
-            "select Distinct gum_institution.name, count(ustartdate.uid) usercount from gum_institution "
-            "LEFT JOIN gum_department on gum_department.institution_id = gum_institution.id "
-            "INNER JOIN gum_userdepartment on gum_userdepartment.department_id = gum_department.id "
-            "INNER JOIN ( "
-            "select distinct gum_user.id uid, max(start_date) sdate "
-            "from gum_userdepartment "
-            "INNER JOIN gum_department on gum_userdepartment.department_id  = gum_department.id "
-            "INNER JOIN gum_user on gum_userdepartment.user_id = gum_user.id "
-            "INNER JOIN gum_usersystem ON gum_userdepartment.user_id = gum_usersystem.user_id "
-            "where gum_userdepartment.end_date is null and gum_usersystem.system_id = 2  "
-            "and gum_department.is_astronomy = 1 "
-            "group by uid) as ustartdate on  ustartdate.uid = gum_userdepartment.user_id "  
-            "where gum_userdepartment.start_date = ustartdate.sdate " 
-            "group by gum_institution.name "
-            "order by usercount desc "
-        )
-
-
-        result = []
-
-        self.cursor.execute(select_astro)
-        for (institution, noofusers) in self.cursor:
-            result.append((institution, noofusers))
-
-        return result
-
-
-
-
-
-
-
-
-
+        directory = self.getSlurmUserDirectory()
+        memberships = self.getLatestMemberships(directory.endd.isnull() & (directory.is_astronomy == ASTRONOMY))
 
+        usercount = memberships.groupby('inst_name', observed=True).size().sort_values(ascending=False, kind='mergesort')
 
+        return list(usercount.items())
@@ -0,0 +1,113 @@
+"""
+Read Slurm user utilisation files, as written by sreport -P -n (pipe separated, no header), into the per login
+and per project usage a Slurm report needs. Files are streamed in chunks, each one folded into the usage
+per (cluster, login, project) before the next is read, so memory grows with the no of users, not of rows.
+The same usage is read from the job events of a cluster ingested by readSlurmStats.py
+"""
+import datetime
+
+import pandas as pd
+
+import storage
+
+
+# Columns of a Slurm utilisation file
+SLURM_COLUMNS = ['Cluster', 'Login', 'Name', 'Account', 'Used', 'Energy']
+
+# Types of the columns of a Slurm utilisation file, usage in CPU hours
+SLURM_DTYPES = {'Cluster': 'category', 'Login': 'category', 'Name': 'category', 'Account': 'category',
+                'Used': 'float64', 'Energy': 'float64'}
+
+# Columns identifying the usage of a user on a project
+SLURM_KEYS = ['Cluster', 'Login', 'Account']
+
+# Projects of administrators and testers, discarded from Slurm reports
+DISCARD_PROJECTS = ['hpcadmin', 'testers', 'root']
+
+# Default no of rows read at a time
+DEFAULT_CHUNK_SIZE = 500000
+
+# Cluster of the Slurm report, job events of its jobs are stored under this name
+OZSTAR_CLUSTER = 'ozstar'
+
+# Usage of a cluster per user and project over a period, in CPU hours, in the order of SLURM_COLUMNS
+# (cluster, start date and day after end date parameters)
+SLURM_EVENTS_USAGE = (
+    "SELECT cluster, `user`, '', `account`, sum(service_units), 0 FROM job_event "
+    "WHERE cluster = %s AND `type` = 'JOBEND' AND `time` >= %s AND `time` < %s "
+    "GROUP BY cluster, `user`, `account`"
+)
+
+
+def aggregateUsage(data):
+    """
+    :param data: DataFrame of SLURM_COLUMNS, several rows per user and project
+    :return: DataFrame of SLURM_COLUMNS, one row per user and project, with total usage and energy
+    """
+    usage = data.groupby(SLURM_KEYS, observed=True, sort=False).agg({'Name': 'first', 'Used': 'sum', 'Energy': 'sum'})
+    return usage.reset_index()[SLURM_COLUMNS]
+
+
+def readSlurmUsage(filepath, discardprojects=DISCARD_PROJECTS, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Read a Slurm utilisation file in chunks, discarding usage of discardprojects and rows without login, whose count is printed
+
+    :param filepath: path of the file, or file object
+    :param discardprojects: list of projects whose rows are dropped
+    :param chunksize: no of rows read at a time
+    :return: DataFrame of SLURM_COLUMNS, one row per cluster, login and project, Cluster, Login, Name and Account categorical
+    """
+    usage = pd.DataFrame(columns=SLURM_COLUMNS)
+    rows = 0
+    nologin = 0
+
+    for chunk in pd.read_csv(filepath, sep='|', header=None, names=SLURM_COLUMNS, dtype=SLURM_DTYPES, chunksize=chunksize):
+        rows += len(chunk)
+        chunk = chunk[~chunk.Account.isin(discardprojects)]
+
+        # rows without login would count as a user of their own, e.g. cluster or project totals
+        missing = chunk.Login.isnull()
+        nologin += int(missing.sum())
+        chunk = chunk[~missing]
+
+        # categories of every chunk differ, so partial usage is merged on values. Rows without cluster or project
+        # are kept under an empty one, so they still count in the total usage
+        partial = aggregateUsage(chunk.astype({column: object for column in SLURM_KEYS}).fillna({column: '' for column in SLURM_KEYS}))
+        partial['Name'] = partial.Name.astype(object)
+        usage = aggregateUsage(pd.concat([usage, partial], ignore_index=True, sort=False)) if len(usage) else partial
+
+    usage = usage.astype(SLURM_DTYPES)
+    print('{0}: {1} rows, {2} users on {3} projects'.format(filepath, rows, usage.Login.nunique(), usage.Account.nunique()))
+    if nologin:
+        print('{0}: {1} rows without login dropped'.format(filepath, nologin))
+
+    return usage
+
+
+def readSlurmEvents(dbconfig, cluster, startdate, enddate, discardprojects=DISCARD_PROJECTS):
+    """
+    Usage of a period from the job events of a Slurm cluster in the Stats database, as readSlurmUsage returns it
+    from a utilisation file. Names are not stored with job events, so they are empty
+
+    :param dbconfig: db_config.ini section of the Stats database, as a dictionary
+    :param cluster: cluster the job events are stored under
+    :param startdate: report start date
+    :param enddate: report end date, included
+    :param discardprojects: list of projects whose usage is dropped
+    :return: DataFrame of SLURM_COLUMNS, one row per cluster, login and project
+    """
+    periodend = '{0:%Y-%m-%d}'.format(pd.Timestamp(enddate) + datetime.timedelta(days=1))
+
+    stats = storage.connect(dbconfig)
+    cursor = stats.con.cursor()
+    try:
+        cursor.execute(SLURM_EVENTS_USAGE, (cluster, '{0:%Y-%m-%d}'.format(pd.Timestamp(startdate)), periodend))
+        usage = pd.DataFrame(cursor.fetchall(), columns=SLURM_COLUMNS)
+    finally:
+        cursor.close()
+        stats.con.close()
+
+    usage = usage[~usage.Account.isin(discardprojects) & (usage.Login != '')].astype(SLURM_DTYPES)
+    print('{0} job events: {1} users on {2} projects'.format(cluster, usage.Login.nunique(), usage.Account.nunique()))
+
+    return usage
@@ -0,0 +1,3 @@
+-- Size on disk of a compressed (gz/bz2/xz) log file once it was read to the end.
+-- processed_log_file.size holds the byte offset parsed so far, in the uncompressed content for compressed logs
+ALTER TABLE processed_log_file ADD COLUMN compressed_size BIGINT NULL;
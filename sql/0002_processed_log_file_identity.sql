@@ -0,0 +1,7 @@
+-- Identity of a log file when last checked, so unchanged files are skipped without reading them
+-- and logs rotated or truncated into the same path are told apart from logs that grew.
+-- mtime is in nanoseconds since epoch; fingerprint is the md5 of the first 4096 bytes of the (uncompressed) log content
+ALTER TABLE processed_log_file
+    ADD COLUMN inode BIGINT UNSIGNED NULL,
+    ADD COLUMN mtime BIGINT NULL,
+    ADD COLUMN fingerprint CHAR(32) NULL;
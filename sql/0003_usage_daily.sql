@@ -0,0 +1,23 @@
+-- Daily usage rollup maintained by statsToDB in the same transaction as every batch of job events,
+-- so quarterly reports scan days x users rows instead of every job event (generateReport.py ... rollup).
+-- day is the date of the job end event, as DATE(job_event.time); qos is the delivered qos
+CREATE TABLE usage_daily (
+    `day` DATE NOT NULL,
+    `user` VARCHAR(64) NOT NULL,
+    `account` VARCHAR(64) NOT NULL,
+    `partition` VARCHAR(64) NOT NULL,
+    qos VARCHAR(64) NOT NULL,
+    jobs INT UNSIGNED NOT NULL,
+    cpu_seconds BIGINT NOT NULL,
+    service_units DOUBLE NOT NULL,
+    PRIMARY KEY (`day`, `user`, `account`, `partition`, qos),
+    INDEX usage_daily_user (`user`, `day`)
+);
+
+-- Backfill from job events already loaded
+INSERT INTO usage_daily(`day`, `user`, `account`, `partition`, qos, jobs, cpu_seconds, service_units)
+SELECT DATE(`time`), `user`, `account`, `partition`, COALESCE(qos_delivered, ''), count(*),
+       sum(TIMESTAMPDIFF(SECOND, start_time, end_time) * cpus), sum(service_units)
+FROM job_event
+WHERE `type` = 'JOBEND'
+GROUP BY DATE(`time`), `user`, `account`, `partition`, COALESCE(qos_delivered, '');
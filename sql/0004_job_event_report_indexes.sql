@@ -0,0 +1,5 @@
+-- Indexes for the quarterly report queries, which select JOBEND events in a time range
+-- and aggregate them by user or by account
+ALTER TABLE job_event
+    ADD INDEX job_event_type_time_user (`type`, `time`, `user`),
+    ADD INDEX job_event_type_time_account (`type`, `time`, `account`);
@@ -0,0 +1,18 @@
+-- Cluster a job ran on, so Slurm clusters (statsToDB parser sacct) store their jobs in job_event and usage_daily
+-- next to gSTAR's. Rows loaded so far are Moab events of gSTAR. Job IDs are unique within a cluster only,
+-- so the cluster leads the keys, and the report indexes, as every report query selects a single cluster
+ALTER TABLE job_event
+    ADD COLUMN cluster VARCHAR(32) NOT NULL DEFAULT 'gstar' FIRST,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (cluster, ID, `time`),
+    DROP INDEX job_event_type_time_user,
+    DROP INDEX job_event_type_time_account,
+    ADD INDEX job_event_cluster_type_time_user (cluster, `type`, `time`, `user`),
+    ADD INDEX job_event_cluster_type_time_account (cluster, `type`, `time`, `account`);
+
+ALTER TABLE usage_daily
+    ADD COLUMN cluster VARCHAR(32) NOT NULL DEFAULT 'gstar' FIRST,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (cluster, `day`, `user`, `account`, `partition`, qos),
+    DROP INDEX usage_daily_user,
+    ADD INDEX usage_daily_cluster_user (cluster, `user`, `day`);
@@ -0,0 +1,128 @@
+-- Schema of a local SQLite file standing in for the gSTAR stats (MySQL), user directory (gum_*) and TAO databases,
+-- with the columns used by statsToDB, reportFromDB and taoreportfromdb. Applied to every new connection, so all IF NOT EXISTS.
+-- Times are stored as 'YYYY-mm-dd HH:MM:SS' text. The MySQL schema changes in sql/*.sql are included already
+-- Files created before job_event and usage_daily had a cluster column are rebuilt on connect, see storage.SQLITE_REBUILT_TABLES
+
+CREATE TABLE IF NOT EXISTS processed_log_file (
+    name TEXT NOT NULL PRIMARY KEY,
+    size INTEGER NOT NULL DEFAULT 0,
+    compressed_size INTEGER NULL,
+    inode INTEGER NULL,
+    mtime INTEGER NULL,
+    fingerprint TEXT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_event (
+    cluster TEXT NOT NULL DEFAULT 'gstar',
+    ID INTEGER NOT NULL,
+    `time` TEXT NOT NULL,
+    `type` TEXT,
+    nodes INTEGER,
+    cpus INTEGER,
+    `user` TEXT,
+    `group` TEXT,
+    `account` TEXT,
+    job_id TEXT,
+    submit_time TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    eligible_time TEXT,
+    queue TEXT,
+    reqwall INTEGER,
+    features TEXT,
+    `memory` INTEGER,
+    `partition` TEXT,
+    rsv TEXT,
+    qos_requested TEXT,
+    qos_delivered TEXT,
+    service_units REAL,
+    PRIMARY KEY (cluster, ID, `time`)
+);
+CREATE INDEX IF NOT EXISTS job_event_cluster_type_time_user ON job_event (cluster, `type`, `time`, `user`);
+CREATE INDEX IF NOT EXISTS job_event_cluster_type_time_account ON job_event (cluster, `type`, `time`, `account`);
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    cluster TEXT NOT NULL DEFAULT 'gstar',
+    `day` TEXT NOT NULL,
+    `user` TEXT NOT NULL,
+    `account` TEXT NOT NULL,
+    `partition` TEXT NOT NULL,
+    qos TEXT NOT NULL,
+    jobs INTEGER NOT NULL,
+    cpu_seconds INTEGER NOT NULL,
+    service_units REAL NOT NULL,
+    PRIMARY KEY (cluster, `day`, `user`, `account`, `partition`, qos)
+);
+CREATE INDEX IF NOT EXISTS usage_daily_cluster_user ON usage_daily (cluster, `user`, `day`);
+
+-- user directory
+CREATE TABLE IF NOT EXISTS gum_institution (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    country TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gum_department (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    institution_id INTEGER REFERENCES gum_institution (id),
+    is_astronomy INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gum_user (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    username TEXT,
+    email_address TEXT,
+    gender INTEGER,
+    is_student INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gum_userdepartment (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES gum_user (id),
+    department_id INTEGER REFERENCES gum_department (id),
+    start_date TEXT,
+    end_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gum_usersystem (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES gum_user (id),
+    system_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gum_project (
+    id INTEGER PRIMARY KEY,
+    code TEXT,
+    name TEXT,
+    project_administrator INTEGER REFERENCES gum_user (id),
+    system_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gum_userproject (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES gum_user (id),
+    project_id INTEGER REFERENCES gum_project (id)
+);
+
+-- TAO
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    insertdate TEXT,
+    latestjobversion INTEGER,
+    database TEXT,
+    filesize INTEGER,
+    recordscount INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tao_taouser (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    gender TEXT,
+    institution TEXT,
+    country TEXT,
+    is_student INTEGER
+);
@@ -34,7 +34,7 @@ def readdbconfig(filename='db_config.ini'):
 
     # gSTAR stats admins
     section = "admins"
-    myconfig[section] = getsectionitems(parser, section)['admin_users'].split(',')
+    myconfig[section] = [admin.strip() for admin in getsectionitems(parser, section)['admin_users'].split(',') if admin.strip()]
 
     return myconfig
 
@@ -1,20 +1,136 @@
 """
-Read gSTAR Job stats from Moab event log files and insert in Stats MySQL database
+Read gSTAR Job stats from Moab event log files and insert in Stats MySQL (or SQLite, see storage.py) database.
+Job records of Slurm clusters, as printed by sacct -P, are inserted in the same tables under their cluster name
 
 """
 
+import bz2
+import collections
+import csv
+import functools
 import glob
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import multiprocessing
+import operator
+import tempfile
 import time
 import os
 
 from mysql.connector import errorcode
-import mysql.connector
+import numpy as np
+import pandas as pd
+
+import storage
+
+
+# Default number of job events written to the database per transaction
+DEFAULT_BATCH_SIZE = 1000
+
+# Cluster of the jobs in Moab event logs, job_event and usage_daily rows are keyed by cluster
+MOAB_CLUSTER = 'gstar'
+
+# Job attributes in job_event insert column order
+JOB_EVENT_FIELDS = ('eventID', 'eventTime', 'eventType', 'nodes', 'cpus', 'user', 'group', 'account',
+                    'jobID', 'submit', 'start', 'end', 'eligible', 'queue', 'reqwall', 'features',
+                    'memory', 'partition', 'rsv', 'qosRequested', 'qosDelivered', 'serviceUnits')
+
+# job_event columns, in the order of JOB_EVENT_FIELDS
+JOB_EVENT_COLUMNS = ('ID,`time`,`type`,nodes,cpus,`user`,`group`,`account`,'
+                     'job_id,submit_time,start_time,end_time,eligible_time,queue,'
+                     'reqwall,features,`memory`,`partition`,rsv,qos_requested,qos_delivered,service_units')
+
+# usage_daily rollup columns, one row per day (of job end), user, account, partition and delivered qos
+USAGE_DAILY_COLUMNS = '`day`,`user`,`account`,`partition`,qos,jobs,cpu_seconds,service_units'
+
+# Load log files with LOAD DATA LOCAL INFILE instead of batched inserts when more files than this are pending
+DEFAULT_BULK_THRESHOLD = 10
+
+# Max no of job_event rows deleted per transaction when purging admin usage
+PURGE_CHUNK_SIZE = 10000
+
+# Seconds between checks for new lines in follow mode
+DEFAULT_FOLLOW_INTERVAL = 5
+
+# Rotated log archives are decompressed on the fly, according to file extension
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Bytes at the head of a log's content hashed to tell whether a path still holds the same log
+FINGERPRINT_SIZE = 4096
+
+# Reasons log lines are not inserted as job events, as counted by the parse stages when asked to
+REJECT_REASONS = ('non-job', 'non-JOBEND', 'malformed', 'excluded')
+
+# Plain log files with more than this no of bytes left to parse are split into ranges parsed by separate workers
+RANGE_SIZE = 64 * 1024 * 1024
+
+# Max no of distinct epoch timestamps kept formatted in memory
+TIME_CACHE_SIZE = 65536
+
+# Log parser backends: Job objects line by line, or pandas C reader over blocks of lines
+PARSERS = ('python', 'pandas')
+
+# Parser of Slurm job records, as printed by sacct -P, instead of Moab event logs
+SACCT_PARSER = 'sacct'
+
+# sacct fields of a job record, in the order of sacct --format
+SACCT_FIELDS = ('JobIDRaw', 'User', 'Group', 'Account', 'Partition', 'QOS', 'Submit', 'Eligible', 'Start', 'End',
+                'ElapsedRaw', 'State', 'NNodes', 'AllocCPUS', 'TimelimitRaw', 'ReqMem', 'Reservation', 'Constraints')
+
+# sacct values of times not set, e.g. end of a running job or start of a job cancelled while pending
+SACCT_UNSET_TIMES = ('Unknown', 'None', '')
+
+# sacct ReqMem units, in Megabytes
+SACCT_MEMORY_UNITS = {'K': 1. / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+
+# Escapes of the characters of job_event values special to LOAD DATA INFILE, as its default FIELDS ESCAPED BY '\\' reads them.
+# Moab values are whitespace split fields, sacct values may hold tabs
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Size in bytes of the blocks of lines read by the pandas parser
+FRAME_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Log fields read by the pandas parser, up to eligible time at index 55
+FRAME_FIELDS = 56
+FRAME_COLUMNS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 12, 14, 15, 22, 26, 28, 33, 37, 43, 55]
+
+# Leading line of FRAME_FIELDS fields, so pandas sizes every block alike whatever its first line is
+FRAME_HEADER = ' '.join(['-'] * FRAME_FIELDS) + '\n'
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def formatTime(epoch):
+    """
+    Convert epoch timestamp, as written in log file, to MySQL DATETIME string.
+    Submit/start/end times repeat heavily within a log, so conversions are memoized
+    
+    :param epoch: seconds since epoch as string
+    :return: 'YYYY-mm-dd HH:MM:SS' string in UTC
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(epoch)))
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def sacctTime(value):
+    """
+    Convert time, as printed by sacct, to MySQL DATETIME string. sacct prints local times,
+    so it is run with TZ=UTC for Slurm jobs to compare with Moab's
+
+    :param value: 'YYYY-mm-ddTHH:MM:SS' string
+    :return: 'YYYY-mm-dd HH:MM:SS' string
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(value, '%Y-%m-%dT%H:%M:%S'))
 
 
 class Job(object):
     """
     class to hold Job data read from log file
     """
+    __slots__ = JOB_EVENT_FIELDS + ('complete',)
+
     def __init__(self, jobStats):
 
         """
@@ -33,8 +149,8 @@ class Job(object):
                 raise ValueError
 
             # Event information
-            self.eventTime = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(jobStats[1].split(':')[0])))
-            self.eventID = jobStats[1].split(':')[1]
+            eventTime, self.eventID = jobStats[1].split(':')[:2]
+            self.eventTime = formatTime(eventTime)
 
             # Job status
             self.eventType = jobStats[4]
@@ -48,10 +164,10 @@ class Job(object):
 
             # Job information
             self.jobID = jobStats[3]
-            self.submit = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(jobStats[12])))
-            self.start = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(jobStats[14])))
-            self.end = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(jobStats[15])))
-            self.eligible = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(jobStats[55])))
+            self.submit = formatTime(jobStats[12])
+            self.start = formatTime(jobStats[14])
+            self.end = formatTime(jobStats[15])
+            self.eligible = formatTime(jobStats[55])
 
             self.serviceUnits = (int(jobStats[15]) - int(jobStats[14])) * self.cpus/60./60.
 
@@ -75,9 +191,19 @@ class Job(object):
         except ValueError:
             self.complete = False
             pass
+        except IndexError:
+            # Truncated line, or qos without requested:delivered pair
+            self.complete = False
 
+    def toRow(self):
+        """
+        Compact representation of the job, in job_event insert column order. Used to pass parsed jobs between processes
+        
+        :return: tuple of job_event column values
+        """
+        return Job._row(self)
 
-
+    _row = operator.attrgetter(*JOB_EVENT_FIELDS)
 
     def getStatValue(value):
         """
@@ -91,164 +217,1278 @@ class Job(object):
             return ''
         return value
 
+class SlurmJob(Job):
+    """
+    class to hold Job data read from a sacct job record, as a Moab JOBEND event
+    """
+    __slots__ = ()
+
+    def __init__(self, record):
+
+        """
+        maps sacct job record to Job object
+
+        :param record: list of strings - fields of the record, in SACCT_FIELDS order
+
+        """
+        try:
+            (self.jobID, self.user, self.group, self.account, self.partition, qos, submit, eligible, start, end,
+             elapsed, state, nodes, cpus, timelimit, memory, self.rsv, self.features) = record
+
+            # Event information; the job ID of the allocation, unique within the cluster
+            self.eventID = self.jobID
+            self.eventType = 'JOBEND'
+            self.eventTime = self.end = sacctTime(end)
+
+            self.nodes = int(nodes)
+            self.cpus = int(cpus)
+
+            # Job information, start and eligible times are not set for jobs cancelled while pending
+            self.submit = sacctTime(submit)
+            self.start = sacctTime(start) if start not in SACCT_UNSET_TIMES else self.end
+            self.eligible = sacctTime(eligible) if eligible not in SACCT_UNSET_TIMES else self.submit
+
+            self.serviceUnits = int(elapsed) * self.cpus/60./60.
+
+            # Slurm partitions are both Moab classes and partitions, and jobs run with the qos they request
+            self.queue = self.partition
+            self.qosRequested = self.qosDelivered = qos
+            self.memory = SlurmJob.getMemory(memory, self.nodes, self.cpus)
+            self.reqwall = int(timelimit) * 60 if timelimit.isdigit() else 0    # UNLIMITED or Partition_Limit
+
+            self.complete = True
+
+        except (ValueError, KeyError):
+            self.complete = False
+
+    @staticmethod
+    def getMemory(value, nodes, cpus):
+        """
+        Memory requested by a job, from sacct ReqMem: an amount with unit, per node (n suffix) or per cpu (c suffix)
+        on older Slurm versions, e.g. 4000Mn, 2Gc or 16G
+
+        :param value: ReqMem value
+        :param nodes: no of nodes of the job
+        :param cpus: no of cpus of the job
+        :return: Megabytes requested by the job
+        """
+        count = {'n': nodes, 'c': cpus}.get(value[-1:])
+        if count is not None:
+            value = value[:-1]
+        else:
+            count = 1
+
+        if not value:
+            return 0
+        if value[-1] in SACCT_MEMORY_UNITS:
+            return int(float(value[:-1]) * SACCT_MEMORY_UNITS[value[-1]] * count)
+        return int(float(value) * count)
+
+
+def openLog(filepath):
+    """
+    Open log file in binary mode, stream-decompressing gz/bz2/xz archives.
+    Offsets on a compressed log are offsets in its uncompressed content
+    
+    :param filepath: Log file path
+    :return: file object
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filepath)[1], open)
+    return opener(filepath, 'rb')
+
+
+def archiveSize(filepath):
+    """
+    Size on disk of a compressed log. Archives don't grow, so it identifies an archive that was read to the end
+    
+    :param filepath: Log file path
+    :return: file size in bytes for compressed logs, None for plain ones
+    """
+    if os.path.splitext(filepath)[1] in COMPRESSED_OPENERS:
+        return os.path.getsize(filepath)
+    return None
+
+
+def fingerprint(filepath):
+    """
+    Digest of the first FINGERPRINT_SIZE bytes of a log's content, uncompressed for archives.
+    Moab only appends to a log, so a file with another head is another log, whatever its path, inode or size
+    
+    :param filepath: Log file path
+    :return: md5 hex digest. None if the log is shorter than FINGERPRINT_SIZE
+    """
+    with openLog(filepath) as myfile:
+        head = myfile.read(FINGERPRINT_SIZE)
+
+    if len(head) < FINGERPRINT_SIZE:
+        return None
+    return hashlib.md5(head).hexdigest()
+
+
+class LogReader(object):
+    """
+    Iterate over complete lines of a log file starting from byte offset, keeping track of the offset reached.
+    A trailing line without newline is still being written by Moab, so it is left for the next run
+    
+    """
+    def __init__(self, filepath, offset=0, end=None):
+        """
+        :param filepath: Log file path
+        :param offset: byte offset to start from, moved back to the start of its line if needed
+        :param end: byte offset to stop at, the end of a range from splitRanges. None to read to end of file
+        """
+        self.filepath = filepath
+        self.offset = offset
+        self.end = end
+
+    def __iter__(self):
+        """
+        :return: generator of (offset after line, stripped line) tuples. Blank lines are skipped
+        """
+        with openLog(self.filepath) as myfile:
+            self.offset = Stats.lineBoundary(myfile, self.offset)
+            myfile.seek(self.offset)
+
+            lines = myfile
+            if self.end is not None:    # bounded by RANGE_SIZE, read at once
+                lines = myfile.read(self.end - self.offset).splitlines(True)
+
+            for line in lines:
+                if not line.endswith(b'\n'):
+                    break
+
+                self.offset += len(line)
+                l = line.decode(errors='replace').strip()
+                if l:
+                    yield self.offset, l
+
+
+class LogFollower(object):
+    """
+    Keep a log file open and return lines appended to it since the last read, as `tail -f` does.
+    Same offset handling as LogReader
+    
+    """
+    def __init__(self, filepath, offset=0):
+        """
+        :param filepath: Log file path, a plain text file still written by Moab
+        :param offset: byte offset to start from, moved back to the start of its line if needed
+        """
+        self.filepath = filepath
+        self.myfile = open(filepath, 'rb')
+        self.offset = Stats.lineBoundary(self.myfile, offset)
+        self.myfile.seek(self.offset)
+        self.rest = b''
+
+    def lines(self):
+        """
+        Read whatever was appended to the file. A trailing line without newline is kept until it's complete
+        
+        :return: generator of (offset after line, stripped line) tuples. Blank lines are skipped
+        """
+        data = self.rest + self.myfile.read()
+        newline = data.rfind(b'\n') + 1
+        self.rest = data[newline:]
+
+        for line in data[:newline].splitlines(True):
+            self.offset += len(line)
+            l = line.decode(errors='replace').strip()
+            if l:
+                yield self.offset, l
+
+    def rotated(self):
+        """
+        Check whether the file was rotated (path now points to a new file) or truncated since it was opened
+        
+        :return: 'rotated', 'truncated' or None
+        """
+        try:
+            status = os.stat(self.filepath)
+        except FileNotFoundError:
+            return 'rotated'
+
+        if status.st_ino != os.fstat(self.myfile.fileno()).st_ino:
+            return 'rotated'
+        if status.st_size < self.offset + len(self.rest):
+            return 'truncated'
+        return None
+
+    def close(self):
+        self.myfile.close()
+
+
+def lockName(filepath):
+    """
+    Name of the database advisory lock held while a log file is being processed
+    
+    :param filepath: Log file path
+    :return: lock name, within MySQL 64 characters limit
+    """
+    return 'gstar_stats:' + hashlib.md5(filepath.encode()).hexdigest()
+
+
+def rejectReason(l):
+    """
+    Why a log line was not decoded into a job event, judging by its leading fields
+    
+    :param l: log line
+    :return: one of REJECT_REASONS
+    """
+    fields = l.split(None, 5)
+    if len(fields) < 3 or fields[2] != 'job':
+        return 'non-job'
+    if len(fields) < 5 or fields[4] != 'JOBEND':
+        return 'non-JOBEND'
+    return 'malformed'
+
+
+def streamLines(myfile):
+    """
+    Iterate over lines of a stream, e.g. piped stdin, as LogReader does over a log file.
+    A stream is complete once it ends, so a trailing line without newline is read too
+
+    :param myfile: file object opened in binary mode
+    :return: generator of (offset after line, stripped line) tuples. Blank lines are skipped
+    """
+    offset = 0
+    for line in myfile:
+        offset += len(line)
+        l = line.decode(errors='replace').strip()
+        if l:
+            yield offset, l
+
+
+def filterJobEnds(lines, rejects=None):
+    """
+    Pipeline stage: keep JOBEND job events only, checking the leading fields without splitting the whole line
+    
+    :param lines: iterable of (offset, line) tuples
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, line) tuples
+    """
+    for offset, l in lines:
+        if ' JOBEND ' in l:
+            fields = l.split(None, 5)
+            if len(fields) > 4 and fields[2] == 'job' and fields[4] == 'JOBEND':
+                yield offset, l
+                continue
+
+        if rejects is not None:
+            rejects[rejectReason(l)] += 1
+
+
+def decodeJobs(lines, rejects=None):
+    """
+    Pipeline stage: map log lines to Job objects, dropping incomplete ones
+    
+    :param lines: iterable of (offset, line) tuples
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, Job) tuples
+    """
+    for offset, l in lines:
+        job = Job(l.split())
+        if job.complete:
+            yield offset, job
+        elif rejects is not None:
+            rejects['malformed'] += 1
+
+
+def filterUsers(jobs, excluded, rejects=None):
+    """
+    Pipeline stage: drop jobs run by excluded users, i.e. system admins
+    
+    :param jobs: iterable of (offset, Job) tuples
+    :param excluded: set of usernames
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, Job) tuples
+    """
+    for offset, job in jobs:
+        if job.user not in excluded:
+            yield offset, job
+        elif rejects is not None:
+            rejects['excluded'] += 1
+
+
+def filterSacctJobEnds(lines, rejects=None):
+    """
+    Pipeline stage: keep sacct records of job allocations that ended, dropping header lines and job steps (e.g. 1234.batch)
+
+    :param lines: iterable of (offset, line) tuples
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, list of record fields) tuples
+    """
+    end = SACCT_FIELDS.index('End')
+
+    for offset, l in lines:
+        record = l.split('|')
+        if not record[0].isdigit():
+            reason = 'non-job'
+        elif len(record) != len(SACCT_FIELDS):
+            reason = 'malformed'
+        elif record[end] in SACCT_UNSET_TIMES:
+            reason = 'non-JOBEND'
+        else:
+            yield offset, record
+            continue
+
+        if rejects is not None:
+            rejects[reason] += 1
+
+
+def decodeSacctJobs(records, rejects=None):
+    """
+    Pipeline stage: map sacct records to SlurmJob objects, dropping incomplete ones
+
+    :param records: iterable of (offset, list of record fields) tuples
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, SlurmJob) tuples
+    """
+    for offset, record in records:
+        job = SlurmJob(record)
+        if job.complete:
+            yield offset, job
+        elif rejects is not None:
+            rejects['malformed'] += 1
+
+
+def batchRows(jobs, batchsize):
+    """
+    Pipeline stage: group jobs into lists of job_event rows
+    
+    :param jobs: iterable of (offset, Job) tuples
+    :param batchsize: max no of rows in a batch
+    :return: generator of (offset after last job in batch, list of row tuples) tuples
+    """
+    rows = []
+    offset = None
+
+    for offset, job in jobs:
+        rows.append(job.toRow())
+
+        if len(rows) >= batchsize:
+            yield offset, rows
+            rows = []
+
+    if rows:
+        yield offset, rows
+
+
+def jobEvents(lines, excluded=(), rejects=None):
+    """
+    Chain the parse stages: JOBEND filter, decode, excluded users filter
+    
+    :param lines: iterable of (offset, line) tuples, e.g. a LogReader
+    :param excluded: set of usernames whose jobs are dropped
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, Job) tuples
+    """
+    return filterUsers(decodeJobs(filterJobEnds(lines, rejects), rejects), excluded, rejects)
+
+
+def sacctJobEvents(lines, excluded=(), rejects=None):
+    """
+    Chain the parse stages of sacct records: ended jobs filter, decode, excluded users filter
+
+    :param lines: iterable of (offset, line) tuples, e.g. a LogReader
+    :param excluded: set of usernames whose jobs are dropped
+    :param rejects: Counter of dropped lines by reason, not counted if None
+    :return: generator of (offset, SlurmJob) tuples
+    """
+    return filterUsers(decodeSacctJobs(filterSacctJobEnds(lines, rejects), rejects), excluded, rejects)
+
+
+class BlockReader(object):
+    """
+    Iterate over blocks of complete lines of a log file starting from byte offset, keeping track of the offset reached.
+    Same offset handling as LogReader, for parsers working on many lines at once
+    
+    """
+    def __init__(self, filepath, offset=0, blocksize=FRAME_BLOCK_SIZE, end=None):
+        """
+        :param filepath: Log file path
+        :param offset: byte offset to start from, moved back to the start of its line if needed
+        :param blocksize: no of bytes read at once
+        :param end: byte offset to stop at, the end of a range from splitRanges. None to read to end of file
+        """
+        self.filepath = filepath
+        self.offset = offset
+        self.blocksize = blocksize
+        self.end = end
+
+    def __iter__(self):
+        """
+        :return: generator of (offset after block, block bytes) tuples. Every block ends with a newline
+        """
+        with openLog(self.filepath) as myfile:
+            self.offset = Stats.lineBoundary(myfile, self.offset)
+            myfile.seek(self.offset)
+
+            rest = b''
+            while True:
+                size = self.blocksize
+                if self.end is not None:
+                    size = min(size, self.end - self.offset - len(rest))
+
+                data = myfile.read(size) if size > 0 else b''
+                if not data:
+                    break
+
+                data = rest + data
+                newline = data.rfind(b'\n')
+                if newline == -1:
+                    rest = data
+                    continue
+
+                block, rest = data[:newline + 1], data[newline + 1:]
+                self.offset += len(block)
+                yield self.offset, block
+
+
+def frameTimes(epochs):
+    """
+    Vectorized formatTime
+    
+    :param epochs: Series of epoch timestamps as integers
+    :return: Series of 'YYYY-mm-dd HH:MM:SS' strings in UTC
+    """
+    times = np.datetime_as_string(epochs.values.astype('datetime64[s]'), unit='s')
+    return pd.Series(times, index=epochs.index).str.replace('T', ' ', regex=False)
+
+
+def frameStatValue(values):
+    """
+    Vectorized Job.getStatValue
+    
+    :param values: Series of stat values as strings
+    :return: Series with '-' replaced by empty string
+    """
+    return values.where(values != '-', '')
+
+
+def decodeFrame(block, excluded=(), rejects=None):
+    """
+    Parse a block of log lines into job_event rows with pandas C reader, producing exactly the rows Job.toRow would.
+    Lines Job can't decode (missing fields, non-integer numbers, qos without ':') are dropped
+    
+    :param block: bytes of complete log lines
+    :param excluded: set of usernames whose jobs are dropped
+    :param rejects: Counter of dropped lines by reason as jobEvents counts them, not counted if None
+    :return: list of job_event row tuples
+    """
+    if b' JOBEND ' not in block and rejects is None:
+        return []
+
+    frame = pd.read_csv(io.StringIO(FRAME_HEADER + block.decode(errors='replace')), sep=r'\s+', header=None,
+                        names=range(FRAME_FIELDS), usecols=FRAME_COLUMNS, dtype=object, quoting=csv.QUOTE_NONE,
+                        keep_default_na=False, na_values=[])
+
+    # whitespace separated fields are never empty, an empty value is a field missing from a short line
+    isjob = frame[2] == 'job'
+    jobs = frame[isjob & (frame[4] == 'JOBEND')]
+    complete = jobs[(jobs != '').all(axis=1)]
+
+    if rejects is not None:
+        rejects['non-job'] += int((~isjob).sum()) - 1   # FRAME_HEADER line
+        rejects['non-JOBEND'] += int(isjob.sum()) - len(jobs)
+        rejects['malformed'] += len(jobs) - len(complete)
+    jobs = complete
+
+    event = jobs[1].str.split(':', n=2, expand=True).reindex(columns=[0, 1])
+    qos = jobs[26].str.split(':', n=2, expand=True).reindex(columns=[0, 1])
+    memory = jobs[37].str.split('M', n=1, expand=True)[0]
+
+    fields = pd.DataFrame({'nodes': jobs[5], 'cpus': jobs[6], 'reqwall': jobs[9], 'submit': jobs[12],
+                           'start': jobs[14], 'end': jobs[15], 'eligible': jobs[55], 'memory': memory,
+                           'eventTime': event[0]})
+
+    # int() accepts an optional sign followed by decimal digits only, to_numeric would also take '1.0' or '1e3'
+    numbers = fields.apply(pd.to_numeric, errors='coerce')
+    valid = numbers.notna().all(axis=1) & fields.apply(lambda column: column.str.lstrip('+-').str.isdecimal()).all(axis=1) \
+        & event[1].notna() & qos[1].notna()
+
+    if rejects is not None:
+        rejects['malformed'] += int((~valid).sum())
+    if excluded:
+        included = ~jobs[7].isin(excluded)
+        if rejects is not None:
+            rejects['excluded'] += int((valid & ~included).sum())
+        valid &= included
+
+    jobs, event, qos, numbers = jobs[valid], event[valid], qos[valid], numbers[valid].astype('int64')
+
+    columns = [event[1], frameTimes(numbers.eventTime), jobs[4], numbers.nodes, numbers.cpus,
+               jobs[7], jobs[8], jobs[28], jobs[3],
+               frameTimes(numbers.submit), frameTimes(numbers.start), frameTimes(numbers.end), frameTimes(numbers.eligible),
+               frameStatValue(jobs[11]).str.replace('[', '', regex=False).str.replace(':1]', '', regex=False),
+               numbers.reqwall, frameStatValue(jobs[22]), numbers.memory, jobs[33], frameStatValue(jobs[43]),
+               frameStatValue(qos[0]), frameStatValue(qos[1]),
+               (numbers.end - numbers.start) * numbers.cpus / 60. / 60.]
+
+    return list(zip(*(column.tolist() for column in columns)))
+
+
+def parseBatches(filepath, offset=0, excluded=(), batchsize=DEFAULT_BATCH_SIZE, parser='python', rejects=None, end=None):
+    """
+    Parse log file from byte offset into batches of job_event rows, with the selected parser backend
+    
+    :param filepath: Log file path
+    :param offset: byte offset to start from
+    :param excluded: set of usernames whose jobs are dropped
+    :param batchsize: max no of rows in a batch
+    :param parser: 'python' for Job objects line by line, 'pandas' for blocks of lines through pandas C reader,
+        SACCT_PARSER for a file of sacct job records
+    :param rejects: Counter of lines dropped by reason, see REJECT_REASONS. Not counted if None
+    :param end: byte offset to stop at, the end of a range from splitRanges. None to parse to end of file
+    :return: generator of (offset, list of row tuples) tuples. offset is where to resume once the batch is committed.
+        The last batch is empty and carries the offset of the last complete line of the file (or range)
+    """
+    if parser == 'pandas':
+        reader = BlockReader(filepath, offset, end=end)
+
+        for blockend, block in reader:
+            rows = decodeFrame(block, excluded, rejects)
+            for i in range(0, len(rows), batchsize):
+                yield (blockend if i + batchsize >= len(rows) else offset), rows[i:i + batchsize]
+            offset = blockend
+
+    elif parser == SACCT_PARSER:
+        reader = LogReader(filepath, offset, end)
+
+        # read records -> ended jobs filter -> decode -> admins filter -> batch
+        for batch in batchRows(sacctJobEvents(reader, excluded, rejects), batchsize):
+            yield batch
+
+    else:
+        reader = LogReader(filepath, offset, end)
+
+        # read lines -> JOBEND filter -> decode -> admins filter -> batch
+        for batch in batchRows(jobEvents(reader, excluded, rejects), batchsize):
+            yield batch
+
+    yield reader.offset, []
+
+
+def splitRanges(filepath, offset=0, rangesize=RANGE_SIZE):
+    """
+    Split the part of a log file left to parse into byte ranges of about rangesize, each ending just after a newline,
+    so they can be parsed by separate workers. Boundaries are found in a memory map of the file.
+    Compressed logs can't be read from the middle, they are a single range
+    
+    :param filepath: Log file path
+    :param offset: byte offset to start from, at the start of a line
+    :param rangesize: approximate size of a range in bytes
+    :return: list of (log file path, start offset, end offset) tuples in file order. The last range ends with the file, end None
+    """
+    if archiveSize(filepath) is not None or os.path.getsize(filepath) - offset <= rangesize:
+        return [(filepath, offset, None)]
+
+    ranges = []
+    with open(filepath, 'rb') as myfile, mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = offset
+        while True:
+            newline = mapped.find(b'\n', start + rangesize - 1)
+            if newline == -1 or newline + 1 >= len(mapped):
+                ranges.append((filepath, start, None))
+                return ranges
+
+            ranges.append((filepath, start, newline + 1))
+            start = newline + 1
+
+
+def parseRange(task, excluded=(), parser='python'):
+    """
+    Parse a range of log file into job_event rows. Runs in a worker process, so it never touches the database
+    
+    :param task: (log file path, byte offset to start from, byte offset to stop at or None for end of file) tuple, see splitRanges
+    :param excluded: set of usernames whose jobs are dropped
+    :param parser: parser backend, see parseBatches
+    :return: (log file path, list of job_event row tuples, start offset, byte offset of the last complete line read) tuple
+    """
+    filepath, start, end = task
+    rows = []
+
+    offset = start
+    for offset, batch in parseBatches(filepath, start, excluded, parser=parser, end=end):
+        rows.extend(batch)
+
+    return filepath, rows, start, offset
+
+
+def summarizeLogs(files, excluded=(), parser='python'):
+    """
+    Parse whole log files through the same pipeline as parseStats, without database, and aggregate the results.
+    A pre-flight check of new logs and a benchmark of the parser backends
+    
+    :param files: Log file paths
+    :param excluded: set of usernames whose jobs are dropped
+    :param parser: parser backend, see parseBatches
+    :return: dictionary of no of files, lines, JOBEND events, rejected lines by reason, service units by account and by user,
+        parse time in seconds and lines per second
+    """
+    account, user, serviceunits = (JOB_EVENT_FIELDS.index(field) for field in ('account', 'user', 'serviceUnits'))
+
+    rejects = collections.Counter({reason: 0 for reason in REJECT_REASONS})
+    accounts = collections.Counter()
+    users = collections.Counter()
+    jobends = 0
+
+    started = time.time()
+    for filepath in files:
+        for offset, rows in parseBatches(filepath, 0, excluded, parser=parser, rejects=rejects):
+            jobends += len(rows)
+            for row in rows:
+                accounts[row[account]] += row[serviceunits]
+                users[row[user]] += row[serviceunits]
+    seconds = time.time() - started
+
+    lines = jobends + sum(rejects.values())
+
+    return {
+        'files': len(files),
+        'lines': lines,
+        'jobend': jobends,
+        'rejected': dict(rejects),
+        'service_units': {'account': {name: round(su, 3) for (name, su) in accounts.most_common()},
+                          'user': {name: round(su, 3) for (name, su) in users.most_common()}},
+        'seconds': round(seconds, 3),
+        'lines_per_second': round(lines / seconds) if seconds else None,
+    }
+
+
 class Stats(object):
     """
     Enclose all operations to parse stats log files and insert job stats into database 
     
     """
-    def __init__(self, path, dbconfig):
+    def __init__(self, path, dbconfig, batchsize=DEFAULT_BATCH_SIZE, parser='python', bulkthreshold=DEFAULT_BULK_THRESHOLD,
+                 cluster=MOAB_CLUSTER):
         """
         Initialize log file path to read stats from as well as DB connection
         
         :param path: log file path
         :param dbConfig: db connection dictionary
+        :param batchsize: no of job events inserted and committed together
+        :param parser: log parser backend, one of PARSERS, or SACCT_PARSER for files of sacct job records
+        :param bulkthreshold: bulk-load files with LOAD DATA LOCAL INFILE when more than this no of files are pending
+        :param cluster: cluster the jobs ran on, job events are stored under
         
         """
         # Set Stats file path
         self.path = path
+        self.parser = parser
+        self.bulkthreshold = bulkthreshold
+        self.cluster = cluster
+
+        # Job events waiting to be written to database
+        self.batchsize = batchsize
+        self.batch = []
+
+        # Log file being parsed and byte offset of the last complete line read from it
+        self.filepath = None
+        self.offset = 0
+        # Size on disk of a compressed log file once it was read to the end
+        self.archivesize = None
 
         try:
-            # connect to database schema using dbConfig dictionary
-            mysqldb = dbconfig['mysql']
-            self.con = mysql.connector.connect(**mysqldb)
+            # connect to database schema using dbConfig dictionary. Only the ingest connection allows LOAD DATA LOCAL INFILE,
+            # needed by bulk loads
+            mysqldb = dict(dbconfig['mysql'])
+            if mysqldb.get('backend', storage.MySQLStorage.name) == storage.MySQLStorage.name:
+                mysqldb.setdefault('allow_local_infile', True)
+            self.storage = storage.connect(mysqldb)
+            self.con = self.storage.con
             self.cursor = self.con.cursor()
+            # switched off if the server refuses LOAD DATA LOCAL INFILE
+            self.localinfile = self.storage.localinfile
             print('connected')
 
+            # admin jobs are dropped while parsing, so they never reach the database
             self.admins = dbconfig['admins']
+            self.excluded = frozenset(self.admins)
 
-        except mysql.connector.Error as err:
-            if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+        except storage.Error as err:
+            # only MySQL errors have an errno
+            errno = getattr(err, 'errno', None)
+            if errno == errorcode.ER_ACCESS_DENIED_ERROR:
                 print("Something is wrong with your user name or password")
-            elif err.errno == errorcode.ER_BAD_DB_ERROR:
+            elif errno == errorcode.ER_BAD_DB_ERROR:
                 print("Database does not exist")
             else:
                 print(err)
+            raise err
 
 
-    def parseStats(self):
+    def parseStats(self, workers=1):
         """
         Loop through log files, parse each file into Job objects (if it wasn't already processed) and insert into database
         
+        :param workers: no of processes parsing log files. With more than one, this process only writes to database
         :return: None 
         """
         try:
             files = glob.glob(self.path)
             print('no of files: ' + str(len(files)))
 
-            for filepath in files:
-                if self.updateProcessedFiles(filepath):  # if the file was not or was partially processed, parse and process
-                    with open(filepath) as myfile:
-                         [self.insertEvent(Job(l.split())) for l in (line.strip() for line in myfile) if l] # insert jobs in database
+            pending = []
+            changes = []
+            for filepath, offset, change in self.checkProcessedFiles(files):
+                if offset is not None:  # if the file was not or was partially processed, parse and process
+                    if not self.lockFile(filepath):  # being ingested by readStats.py --follow
+                        print('skipping {0}, locked by another process'.format(filepath))
+                        continue
+                    pending.append((filepath, offset))
+
+                if change is not None:
+                    changes.append(change)
+
+            self.updateProcessedFiles(changes)
+
+            bulk = len(pending) > self.bulkthreshold
 
-            if(self.admins != []):
-                self.deleteAdminUsage()
+            # large files are split, so that a single file is parsed by several workers too
+            ranges = [task for filepath, offset in pending for task in splitRanges(filepath, offset)] if workers > 1 else []
+
+            if len(ranges) > 1:
+                self.parseParallel(ranges, workers, bulk)
+            else:
+                for filepath, offset in pending:
+                    batches = parseBatches(filepath, offset, self.excluded, self.batchsize, self.parser)
+                    if not (bulk and self.bulkLoad(filepath, offset, batches)):
+                        self.parseFile(filepath, offset)
 
         except Exception as e:
             raise e
         finally:
-            self.cursor.close()
-            self.con.close()
+            self.finalize()
 
 
-    def insertEvent(self, job):
+    def parseFile(self, filepath, offset=0):
         """
-        Insert Job object in job_event table
+        Parse log file starting from byte offset and insert its jobs in database.
+        A trailing line without newline is still being written by Moab, so it is left for the next run
         
+        :param filepath: Log file path
+        :param offset: byte offset to resume from, as stored in processed_log_file
         :return: None
-         
         """
+        self.filepath = filepath
 
-        if job:
-            if not job.complete:
-                return
-            try:
+        # the last batch is empty and advances offset past trailing non-job lines, one commit per file at least
+        for self.offset, self.batch in parseBatches(filepath, offset, self.excluded, self.batchsize, self.parser):
+            self.flushEvents()
+
+        self.archivesize = archiveSize(filepath)
+        if self.archivesize is not None:
+            self.flushEvents()  # mark compressed log as read to the end
+
+        self.filepath = None
+        self.archivesize = None
+
+    def parseStream(self, myfile):
+        """
+        Parse job events from a stream, e.g. sacct output piped into stdin, and insert them in database in batches.
+        A stream can't be read again, so there's no offset to resume from
+
+        :param myfile: file object opened in binary mode
+        :return: None
+        """
+        events = sacctJobEvents if self.parser == SACCT_PARSER else jobEvents
+
+        try:
+            for self.offset, self.batch in batchRows(events(streamLines(myfile), self.excluded), self.batchsize):
+                self.flushEvents()
+
+        except Exception as e:
+            raise e
+        finally:
+            self.finalize()
+
+    def parseParallel(self, ranges, workers, bulk=False):
+        """
+        Parse ranges of log files in a pool of worker processes, while this process writes the returned rows into database.
+        Ranges complete in any order and their rows are committed as they come, but a file's offset in processed_log_file
+        only advances past ranges whose preceding ranges are all committed, so an interrupted run resumes without gaps
+        
+        :param ranges: list of (log file path, start offset, end offset) tuples in file order, see splitRanges
+        :param workers: no of worker processes
+        :param bulk: load rows with LOAD DATA LOCAL INFILE instead of batched inserts
+        :return: None
+        """
+        frontier = {}   # file offset up to which all ranges are committed
+        finished = collections.defaultdict(dict)    # start: end of the ranges committed past the frontier
+        remaining = collections.Counter()
+        for filepath, start, end in ranges:
+            frontier.setdefault(filepath, start)
+            remaining[filepath] += 1
+
+        with multiprocessing.Pool(workers) as pool:
+            parser = functools.partial(parseRange, excluded=self.excluded, parser=self.parser)
+            for filepath, rows, start, end in pool.imap_unordered(parser, ranges):
+                committed = frontier[filepath]
+                finished[filepath][start] = end
+                while frontier[filepath] in finished[filepath]:
+                    frontier[filepath] = finished[filepath].pop(frontier[filepath])
+                remaining[filepath] -= 1
+
+                if bulk and self.bulkLoad(filepath, committed, [(frontier[filepath], rows)]):
+                    continue
+
+                self.filepath = filepath
+                self.offset = committed
+
+                for row in rows:
+                    self.queueRow(row)
 
-                addEventStatement = (
-                    'INSERT INTO job_event(ID,`time`,`type`,nodes,cpus,`user`,`group`,`account`,'
-                    'job_id,submit_time,start_time,end_time,eligible_time,queue,'
-                    'reqwall,features,`memory`,`partition`,rsv,qos_requested,qos_delivered,service_units) '
-                    'VALUES( %(eventID)s , %(eventTime)s ,  %(eventType)s , %(nodes)s , %(cpus)s ,'
-                    ' %(user)s , %(group)s ,  %(account)s , %(jobID)s , %(submit)s ,'
-                    ' %(start)s , %(end)s ,  %(eligible)s , %(queue)s , %(reqwall)s ,'
-                    ' %(features)s ,  %(memory)s , %(partition)s , %(rsv)s , %(qosRequested)s, %(qosDelivered)s, %(serviceUnits)s )'
-                )
-                # eventData = (job.eventID, job.eventTime, job.eventType, job.nodes, job.cpus, job.user, job.group, job.account, job.jobID, job.submit, job.start, job.end, job.eligible, job.queue, job.reqwall, job.features, job.memory, job.partition, job.rsv, job.qosRequested, job.qosDelivered, job.serviceUnits)
+                self.offset = frontier[filepath]
+                if not remaining[filepath]:
+                    self.archivesize = archiveSize(filepath)
+                self.flushEvents()
+                self.filepath = None
+                self.archivesize = None
 
+    def follow(self, interval=DEFAULT_FOLLOW_INTERVAL):
+        """
+        Keep ingesting new JOBEND events from the most recently modified log file, checking for appended lines every interval seconds.
+        Moves to a new file when the log is rotated. Offsets are kept in processed_log_file as for parseStats,
+        and the file being followed is locked so that parseStats runs skip it. Runs until interrupted
+        
+        :param interval: seconds between checks for new lines
+        :return: None
+        """
+        follower = None
+
+        try:
+            while True:
+                latest = self.activeFile()
+
+                if follower is not None:
+                    self.followFile(follower)  # drain lines written before any rotation
 
-                try:
+                    change = follower.rotated()
+                    if change or latest != follower.filepath:
+                        print('{0} {1}'.format(follower.filepath, change or 'superseded by ' + str(latest)))
+                        follower.close()
 
-                    self.cursor.execute(addEventStatement, job.__dict__)
-                    self.con.commit()
+                        if change:
+                            # the path now names a new or truncated file, to be read from its start
+                            self.filepath, self.offset = follower.filepath, 0
+                            self.flushEvents()
+                            self.filepath = None
 
-                except mysql.connector.Error as err:
-                    if err.errno == errorcode.ER_DUP_KEY:
-                        pass
-                    else:
-                        print(err)
-            except AttributeError as err:
-                pass
+                        self.unlockFile(follower.filepath)
+                        follower = None
+                        continue
 
-    def updateProcessedFiles(self, path):
+                elif latest is not None and self.lockFile(latest):
+                    for filepath, offset, change in self.checkProcessedFiles([latest]):
+                        self.updateProcessedFiles([change] if change is not None else [])
+                        follower = LogFollower(filepath, os.path.getsize(filepath) if offset is None else offset)
+                        print('following {0} from offset {1}'.format(filepath, follower.offset))
 
+                    if follower is None:    # rotated away since listed
+                        self.unlockFile(latest)
+                    continue
+
+                time.sleep(interval)
+
+        except KeyboardInterrupt:
+            print('stopped')
+        finally:
+            if follower is not None:
+                follower.close()
+            self.finalize()
+
+    def followFile(self, follower):
         """
-        Updates Processed files table in database. Insert new record if file wasn't processed before. 
-        Updates existing record if only part of the file was processed. Does nothing if the whole file was processed
+        Insert JOBEND events appended to followed log file in small batches, advancing its offset
         
-        :param path: Log file path
-        :return: True if updates were done. False if no change
+        :param follower: LogFollower of the file
+        :return: None
+        """
+        self.filepath = follower.filepath
+        self.offset = follower.offset
+
+        for self.offset, self.batch in batchRows(jobEvents(follower.lines(), self.excluded), self.batchsize):
+            self.flushEvents()
+
+        if follower.offset != self.offset:  # trailing non-job lines
+            self.offset = follower.offset
+            self.flushEvents()
+
+        self.filepath = None
+
+    def activeFile(self):
+        """
+        Log file currently written by Moab; the most recently modified plain file matching the log files path
         
+        :return: Log file path. None if there's none
         """
-        # Get filesize
-        filesize = os.path.getsize(path)
+        files = [filepath for filepath in glob.glob(self.path) if archiveSize(filepath) is None]
 
         try:
-            # print("update")
-            selectFileStatement = "SELECT size FROM processed_log_file WHERE name= %s"
+            return max(files, key=os.path.getmtime) if files else None
+        except FileNotFoundError:   # rotated while checking
+            return None
 
-            self.cursor.execute(selectFileStatement, (path,))
-            size = self.cursor.fetchone()
+    def lockFile(self, filepath):
+        """
+        Take the database advisory lock of a log file, so only one process ingests it at a time.
+        Locks are released when the connection is closed
+        
+        :param filepath: Log file path
+        :return: True if the lock was taken. False if another process holds it
+        """
+        return self.storage.lock(self.cursor, lockName(filepath))
 
-            if not size:    # file wasn't processed before
-                insertFileStatement = "INSERT INTO processed_log_file(name, size) VALUES(%s, %s)" # insert in database
-                self.cursor.execute(insertFileStatement, (path, filesize))
+    def unlockFile(self, filepath):
+        """
+        Release the database advisory lock of a log file
+        
+        :param filepath: Log file path
+        :return: None
+        """
+        self.storage.unlock(self.cursor, lockName(filepath))
 
-            elif size[0] == filesize:   # whole file was processed before
+    @staticmethod
+    def lineBoundary(myfile, offset):
+        """
+        Move offset back to the start of the line it falls in, so a line that was partially read is parsed again
+        
+        :param myfile: log file opened in binary mode
+        :param offset: byte offset in file
+        :return: offset of the first byte following a newline, at or before offset
+        """
+        while offset > 0:
+            start = max(0, offset - 4096)
+            myfile.seek(start)
+            block = myfile.read(offset - start)
+
+            newline = block.rfind(b'\n')
+            if newline == len(block) - 1:
+                break
+            if newline != -1:
+                return start + newline + 1
+
+            offset = start
+
+        return offset
+
+    def queueRow(self, row):
+        """
+        Queue job_event row for insertion, writing the batch once it is full
+        
+        :param row: tuple of job_event column values, as returned by Job.toRow
+        :return: None
+        """
+        self.batch.append(row)
+
+        if len(self.batch) >= self.batchsize:
+            self.flushEvents()
+
+    def flushEvents(self):
+        """
+        Insert all queued Job objects in the staging table using a single multi-row insert, merge them into job_event
+        and usage_daily rollup, and commit. Events already in job_event (duplicate key) are skipped without failing the rest of the batch.
+        The offset of the file being parsed is advanced in the same transaction, so a failed batch is read again on the next run
+        
+        :return: None
+        
+        """
+
+        addEventStatement = (
+            'INSERT INTO job_event_staging(' + JOB_EVENT_COLUMNS + ') '
+            'VALUES( %s , %s , %s , %s , %s , %s , %s , %s , %s , %s , %s ,'
+            ' %s , %s , %s , %s , %s , %s , %s , %s , %s , %s , %s ) '
+        )
+
+        try:
+            if self.batch:
+                self.createStaging()
+                self.cursor.executemany(addEventStatement, self.batch)
+                self.mergeStaging()
+
+            if self.filepath:
+                updateFileStatement = "UPDATE processed_log_file SET size= %s, compressed_size= %s WHERE name= %s"
+                self.cursor.execute(updateFileStatement, (self.offset, self.archivesize, self.filepath))
+
+            self.con.commit()
+
+        except storage.Error as err:
+            self.con.rollback()
+            print(err)
+            raise err
+        finally:
+            self.batch = []
+
+    def createStaging(self):
+        """
+        Create the connection's empty temporary staging table of job events, or empty it if it exists already.
+        It has no keys, duplicates are dropped by mergeStaging
+        
+        :return: None
+        """
+        stagingStatement = (
+            "CREATE TEMPORARY TABLE IF NOT EXISTS job_event_staging AS "
+            "SELECT " + JOB_EVENT_COLUMNS + " FROM job_event LIMIT 0"
+        )
+        self.cursor.execute(stagingStatement)
+        self.cursor.execute("DELETE FROM job_event_staging")
+
+    def mergeStaging(self):
+        """
+        Merge staged job events into job_event under the cluster of this Stats, skipping duplicates,
+        then add the merged events to usage_daily rollup. Staged events already in job_event, e.g. from a file parsed again after a failure, are dropped first,
+        so the rollup reads back exactly the rows merged and every event is counted once,
+        even if a batch holds different events with the same key. Runs within the caller's transaction
+        
+        :return: None
+        """
+        dropStatement = (
+            "DELETE FROM job_event_staging WHERE EXISTS (SELECT 1 FROM job_event "
+            "WHERE job_event.cluster = %s AND job_event.ID = job_event_staging.ID AND job_event.`time` = job_event_staging.`time`)"
+        )
+        self.cursor.execute(dropStatement, (self.cluster,))
+
+        mergeStatement = (
+            self.storage.insertIgnore + " INTO job_event(cluster," + JOB_EVENT_COLUMNS + ") "
+            "SELECT %s," + JOB_EVENT_COLUMNS + " FROM job_event_staging"
+        )
+        self.cursor.execute(mergeStatement, (self.cluster,))
+
+        # Moab jobs run from start to end. Slurm service units are of the elapsed time, which leaves out time suspended,
+        # so cpu seconds are taken from them
+        if self.parser == SACCT_PARSER:
+            cpuSeconds = "round(sum(new.service_units) * 3600)"
+        else:
+            cpuSeconds = "sum(" + self.storage.secondsBetween('new.start_time', 'new.end_time') + " * new.cpus)"
+
+        rollupStatement = (
+            "INSERT INTO usage_daily(cluster," + USAGE_DAILY_COLUMNS + ") "
+            "SELECT new.cluster, DATE(new.`time`), new.`user`, new.`account`, new.`partition`, new.qos_delivered, count(*), "
+            + cpuSeconds + ", sum(new.service_units) "
+            "FROM job_event AS new INNER JOIN (SELECT DISTINCT ID, `time` FROM job_event_staging) AS staged "
+            "ON new.cluster = %s AND new.ID = staged.ID AND new.`time` = staged.`time` "
+            "GROUP BY new.cluster, DATE(new.`time`), new.`user`, new.`account`, new.`partition`, new.qos_delivered "
+            + self.storage.upsertAdd(['cluster', '`day`', '`user`', '`account`', '`partition`', 'qos'],
+                                     ['jobs', 'cpu_seconds', 'service_units'])
+        )
+        self.cursor.execute(rollupStatement, (self.cluster,))
+
+    def bulkLoad(self, filepath, offset, batches):
+        """
+        Write parsed rows of a log file to a temporary TSV file, LOAD DATA LOCAL INFILE it into a staging table
+        and merge into job_event and usage_daily rollup skipping duplicates, then advance the file offset. All in one transaction.
+        If the server or client refuses LOCAL INFILE, bulk loading is switched off and nothing is written
+        
+        :param filepath: Log file path
+        :param offset: byte offset parsing started from
+        :param batches: iterable of (offset, list of row tuples) tuples, as returned by parseBatches
+        :return: True if the file was loaded. False if bulk loading isn't available
+        """
+        if not self.localinfile:
+            return False
+
+        tsv = tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False)
+        try:
+            with tsv:
+                for offset, rows in batches:
+                    tsv.writelines('\t'.join(str(value).translate(TSV_ESCAPES) for value in row) + '\n' for row in rows)
+
+            self.createStaging()
+
+            try:
+                loadStatement = "LOAD DATA LOCAL INFILE %s INTO TABLE job_event_staging (" + JOB_EVENT_COLUMNS + ")"
+                self.cursor.execute(loadStatement, (tsv.name,))
+            except storage.Error as err:
+                self.con.rollback()
+                print("Bulk load not available, inserting in batches: {0}".format(err))
+                self.localinfile = False
                 return False
-            else: # part of the file was processed
-                updateFileStatement = "UPDATE processed_log_file SET size= %s WHERE name= %s"  # update file size in table
-                self.cursor.execute(updateFileStatement, (filesize, path))
+
+            self.mergeStaging()
+
+            updateFileStatement = "UPDATE processed_log_file SET size= %s, compressed_size= %s WHERE name= %s"
+            self.cursor.execute(updateFileStatement, (offset, archiveSize(filepath), filepath))
 
             self.con.commit()
+            print("bulk loaded {0}".format(filepath))
             return True
 
-        except mysql.connector.Error as err:
-            # print(err)
-            return False
+        except storage.Error as err:
+            self.con.rollback()
+            print(err)
+            raise err
+        finally:
+            os.remove(tsv.name)
 
-    def deleteAdminUsage(self):
+    def loadManifest(self):
         """
-        delete usage(events) by system admins, so not to be count in Stats and report. admin usernames are listed in config.ini
-        :return: 
+        Read the whole processed_log_file table in a single query
+        
+        :return: dictionary of log file path: (byte offset parsed, compressed_size, inode, mtime, fingerprint) tuples
         """
         try:
+            selectFilesStatement = "SELECT name, size, compressed_size, inode, mtime, fingerprint FROM processed_log_file"
+            self.cursor.execute(selectFilesStatement)
+            return {row[0]: row[1:] for row in self.cursor.fetchall()}
 
-            print(tuple(self.admins))
+        except storage.Error as err:
+            print(err)
+            raise err
 
-            deleteAdminUsageStat = "DELETE FROM job_event WHERE job_event.user IN " + str(tuple(self.admins))
+    def checkProcessedFiles(self, files):
+        """
+        Compare log files against the processed_log_file manifest, loaded in a single query, to find where to resume parsing each of them.
+        A file with the inode and mtime recorded in the manifest is decided from its size alone, without reading it.
+        Otherwise its head fingerprint tells whether it's the same log grown or touched (resume from the recorded offset)
+        or a new log rotated or truncated into the same path (parse again from the start).
+        A path new to the manifest whose fingerprint is recorded for another path, e.g. a log compressed by rotation, resumes from that path's offset.
+        The size stored for a file is the byte offset parsed so far, in the uncompressed content for compressed logs,
+        and compressed_size is set once an archive was read to the end
+        
+        :param files: Log file paths
+        :return: list of (log file path, byte offset to resume parsing from or None if the whole file was processed, manifest change or None) tuples.
+                 Manifest changes are to be written by updateProcessedFiles
+        """
+        manifest = self.loadManifest()
 
+        # furthest offset parsed in every fingerprinted log, under any path
+        parsed = {}
+        for (size, compressedsize, inode, mtime, head) in manifest.values():
+            if head is not None:
+                parsed[head] = max(size, parsed.get(head, 0))
 
-            print(deleteAdminUsageStat)
-            self.cursor.execute(deleteAdminUsageStat)
-            self.con.commit()
+        checked = []
+        for filepath in files:
+            try:
+                status = os.stat(filepath)
+            except FileNotFoundError:   # rotated away since listed
+                continue
+
+            archivesize = archiveSize(filepath)
+            entry = manifest.get(filepath)
+
+            if entry is None:   # file wasn't processed before, unless it was under another path
+                head = fingerprint(filepath)
+                offset = parsed.get(head, 0) if head is not None else 0
+                if archivesize is None and offset > status.st_size:
+                    offset = 0
+                change = ('insert', filepath, offset, status.st_ino, status.st_mtime_ns, head)
+
+                # an archive's uncompressed size is unknown until read, so it is always read to its end
+                if archivesize is None and offset == status.st_size:
+                    offset = None
+                checked.append((filepath, offset, change))
+                continue
+
+            size, compressedsize, inode, mtime, head = entry
+            change = None
+
+            if inode != status.st_ino or mtime != status.st_mtime_ns:
+                newhead = fingerprint(filepath)
+
+                if (head is not None and newhead != head) or \
+                        (archivesize is None and size > status.st_size) or \
+                        (compressedsize is not None and compressedsize != archivesize):
+                    # another log under the same path, parse it again from the start
+                    checked.append((filepath, 0, ('reset', filepath, 0, status.st_ino, status.st_mtime_ns, newhead)))
+                    continue
+
+                change = ('identity', filepath, size, status.st_ino, status.st_mtime_ns, newhead)
+
+            if archivesize is not None:
+                offset = None if compressedsize == archivesize else size
+            elif size > status.st_size:     # truncated without its mtime changing
+                offset = 0
+                change = ('reset', filepath, 0, status.st_ino, status.st_mtime_ns, fingerprint(filepath))
+            else:
+                offset = None if size == status.st_size else size
+
+            checked.append((filepath, offset, change))
 
+        return checked
 
-        except mysql.connector.Error as err:
+    def updateProcessedFiles(self, changes):
+        """
+        Write manifest changes found by checkProcessedFiles to processed_log_file, all in one transaction.
+        New files are inserted; files replaced under the same path are reset to offset 0;
+        otherwise only inode, mtime and fingerprint are updated, so the offset advanced by a concurrent follower is left alone
+        
+        :param changes: list of (change kind, log file path, byte offset, inode, mtime, fingerprint) tuples
+        :return: None
+        """
+        statements = {
+            'insert': "INSERT INTO processed_log_file(name, size, inode, mtime, fingerprint) VALUES(%s, %s, %s, %s, %s)",
+            'reset': "UPDATE processed_log_file SET size= %s, compressed_size= NULL, inode= %s, mtime= %s, fingerprint= %s WHERE name= %s",
+            'identity': "UPDATE processed_log_file SET inode= %s, mtime= %s, fingerprint= %s WHERE name= %s",
+        }
+        params = {kind: [] for kind in statements}
+
+        for (kind, name, offset, inode, mtime, head) in changes:
+            if kind == 'insert':
+                params[kind].append((name, offset, inode, mtime, head))
+            elif kind == 'reset':
+                params[kind].append((offset, inode, mtime, head, name))
+            else:
+                params[kind].append((inode, mtime, head, name))
+
+        try:
+            for kind, statement in statements.items():
+                if params[kind]:
+                    self.cursor.executemany(statement, params[kind])
+            self.con.commit()
+
+        except storage.Error as err:
+            self.con.rollback()
             print(err)
-            raise(err)
+            raise err
 
+    def deleteAdminUsage(self):
+        """
+        delete usage(events) by system admins, so not to be count in Stats and report. admin usernames are listed in config.ini.
+        Admin jobs are already dropped while parsing, so this is only needed once after the admin list changes.
+        Rows are deleted in chunks, each in its own transaction, to keep row locks short
+        :return: no of deleted events
+        """
+        if not self.admins:
+            return 0
+
+        try:
+
+            print(tuple(self.admins))
+
+            deleteAdminUsageStat = (
+                "DELETE FROM job_event WHERE job_event.user IN (" + ','.join(['%s'] * len(self.admins)) + ")"
+            )
+            if self.storage.limitedDelete:
+                deleteAdminUsageStat += " LIMIT " + str(PURGE_CHUNK_SIZE)
 
+            deleted = 0
+            while True:
+                self.cursor.execute(deleteAdminUsageStat, tuple(self.admins))
+                count = self.cursor.rowcount
+                self.con.commit()
 
+                deleted += count
+                if count < PURGE_CHUNK_SIZE:
+                    break
 
+            # rollup rows are few, a single transaction
+            deleteAdminRollupStat = "DELETE FROM usage_daily WHERE usage_daily.user IN (" + ','.join(['%s'] * len(self.admins)) + ")"
+            self.cursor.execute(deleteAdminRollupStat, tuple(self.admins))
+            self.con.commit()
 
+            print("{0} admin events deleted".format(deleted))
+            return deleted
 
+        except storage.Error as err:
+            print(err)
+            raise(err)
 
+    def finalize(self):
+        """
+        Close database connection
+        :return: None
+        """
+        self.cursor.close()
+        self.con.close()
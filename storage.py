@@ -0,0 +1,276 @@
+"""
+Storage backends of the gSTAR stats and TAO databases: MySQL or Postgres servers, or a local SQLite file.
+A backend opens the connection and supplies the few SQL constructs that differ between databases; all other SQL is shared.
+The backend of a database is chosen in its db_config.ini section, e.g.
+    [mysql]
+    backend = sqlite
+    database = /var/lib/gstar/stats.sqlite
+mysql, tao-mysql sections default to mysql backend, tao-postgres section to postgres
+"""
+import os
+import re
+import sqlite3
+from configparser import ConfigParser
+
+import mysql.connector
+import mysql.connector.pooling
+import psycopg2
+import psycopg2.pool
+
+
+# Backend names, as set in db_config.ini
+BACKENDS = ('mysql', 'postgres', 'sqlite')
+
+# Errors raised by any backend
+Error = (mysql.connector.Error, psycopg2.DatabaseError, sqlite3.Error)
+
+# Tables of the stats, user directory and TAO databases, created in new SQLite files
+SQLITE_SCHEMA = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'sql', 'sqlite', 'schema.sql')
+
+# Tables of SQLite files created before a column was added to their primary key (sql/0005 on MySQL), with that column.
+# SQLite can't change a primary key, so such tables are rebuilt with the schema, existing rows taking the column default
+SQLITE_REBUILT_TABLES = (('job_event', 'cluster'), ('usage_daily', 'cluster'))
+
+
+def readBoolean(value):
+    """
+    :param value: bool, or string of db_config.ini, e.g. true, yes, 1, false, no, 0
+    :return: bool, as ConfigParser.getboolean reads it
+    """
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() not in ConfigParser.BOOLEAN_STATES:
+        raise ValueError('not a boolean: {0}'.format(value))
+    return ConfigParser.BOOLEAN_STATES[str(value).lower()]
+
+
+class MySQLStorage(object):
+    """
+    MySQL server, the production gSTAR stats database
+
+    """
+    name = 'mysql'
+
+    # statement prefix inserting rows, skipping those with an existing key
+    insertIgnore = 'INSERT IGNORE'
+
+    # LOAD DATA LOCAL INFILE bulk loads, only on connections opened with allow_local_infile, and DELETE ... LIMIT chunked deletes
+    localinfile = False
+    limitedDelete = True
+
+    def __init__(self, config):
+        """
+        :param config: connection dictionary, as passed to the database driver
+        """
+        if self.name == 'mysql' and 'allow_local_infile' in config:
+            config = dict(config, allow_local_infile=readBoolean(config['allow_local_infile']))
+            self.localinfile = config['allow_local_infile']
+        self.config = config
+        self.con = self.connect(config)
+
+    def connect(self, config):
+        return mysql.connector.connect(**config)
+
+    def pool(self, size):
+        """
+        Pool of connections to the database, for queries run concurrently by threads
+
+        :param size: no of connections
+        :return: pool, passed to getConnection and putConnection
+        """
+        return mysql.connector.pooling.MySQLConnectionPool(pool_size=size, **self.config)
+
+    def getConnection(self, pool):
+        """
+        :param pool: pool returned by pool()
+        :return: connection for the calling thread only
+        """
+        return pool.get_connection()
+
+    def putConnection(self, pool, con):
+        """
+        Return a connection taken by getConnection to the pool
+
+        :param pool: pool returned by pool()
+        :param con: connection
+        :return: None
+        """
+        con.close()  # pooled connections go back to their pool when closed
+
+    def closePool(self, pool):
+        """
+        Close the connections of a pool, once all taken by getConnection were returned
+
+        :param pool: pool returned by pool()
+        :return: None
+        """
+        pool._remove_connections()  # mysql.connector pools have no public close
+
+    def secondsBetween(self, start, end):
+        """
+        :param start: SQL expression of a DATETIME
+        :param end: SQL expression of a later DATETIME
+        :return: SQL expression of the no of seconds from start to end
+        """
+        return 'TIMESTAMPDIFF(SECOND, {0}, {1})'.format(start, end)
+
+    def upsertAdd(self, keys, columns):
+        """
+        Clause of an INSERT adding the values of a row to those of the existing row with the same key
+
+        :param keys: key columns of the table
+        :param columns: columns to add up
+        :return: SQL clause
+        """
+        return 'ON DUPLICATE KEY UPDATE ' + ', '.join('{0} = {0} + VALUES({0})'.format(column) for column in columns)
+
+    def lock(self, cursor, name):
+        """
+        Take an advisory lock, held until released or until the connection is closed
+
+        :param cursor: cursor of the connection
+        :param name: lock name
+        :return: True if the lock was taken. False if another connection holds it
+        """
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        return cursor.fetchone()[0] == 1
+
+    def unlock(self, cursor, name):
+        """
+        Release an advisory lock
+
+        :param cursor: cursor of the connection
+        :param name: lock name
+        :return: None
+        """
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+        cursor.fetchone()
+
+
+class PostgresStorage(MySQLStorage):
+    """
+    Postgres server, the TAO jobs database. Only read by reports
+
+    """
+    name = 'postgres'
+
+    def connect(self, config):
+        return psycopg2.connect(**config)
+
+    def pool(self, size):
+        return psycopg2.pool.ThreadedConnectionPool(1, size, **self.config)
+
+    def getConnection(self, pool):
+        return pool.getconn()
+
+    def putConnection(self, pool, con):
+        pool.putconn(con)
+
+    def closePool(self, pool):
+        pool.closeall()
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor running the SQL written for MySQL/Postgres: %s placeholders, public schema prefix of TAO tables
+
+    """
+    PUBLIC_SCHEMA = re.compile(r'\bpublic\.')
+
+    def execute(self, statement, params=None):
+        return super().execute(self.translate(statement), params or ())
+
+    def executemany(self, statement, params):
+        return super().executemany(self.translate(statement), params)
+
+    def translate(self, statement):
+        return self.PUBLIC_SCHEMA.sub('', statement.replace('%s', '?'))
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self.description)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """
+    sqlite3 connection handing out SQLiteCursor cursors
+
+    """
+    def cursor(self, factory=SQLiteCursor):
+        return super().cursor(factory)
+
+
+class SQLiteStorage(MySQLStorage):
+    """
+    Local SQLite file holding all databases, for small sites, CI runs and reproducible benchmarks.
+    Tables are created in a new file from SQLITE_SCHEMA. A single process writes at a time, so locks always succeed
+
+    """
+    name = 'sqlite'
+    insertIgnore = 'INSERT OR IGNORE'
+    localinfile = False
+    limitedDelete = False
+
+    def connect(self, config):
+        con = sqlite3.connect(config['database'], factory=SQLiteConnection)
+
+        rebuilt = []
+        for (table, column) in SQLITE_REBUILT_TABLES:
+            columns = [row[1] for row in con.execute("PRAGMA table_info(" + table + ")")]
+            if columns and column not in columns:
+                con.execute("ALTER TABLE " + table + " RENAME TO " + table + "_old")
+                rebuilt.append((table, ','.join('`' + name + '`' for name in columns)))
+
+        with open(SQLITE_SCHEMA) as schema:
+            con.executescript(schema.read())
+
+        for (table, columns) in rebuilt:
+            con.execute("INSERT INTO " + table + "(" + columns + ") SELECT " + columns + " FROM " + table + "_old")
+            con.execute("DROP TABLE " + table + "_old")
+            print('{0} upgraded to the current schema'.format(table))
+        con.commit()
+
+        return con
+
+    def pool(self, size):
+        # connecting to a local file is cheap, every thread opens its own connection
+        return None
+
+    def getConnection(self, pool):
+        # tables were created or upgraded by the connection of the storage, pooled connections only open the file
+        return sqlite3.connect(self.config['database'], factory=SQLiteConnection)
+
+    def putConnection(self, pool, con):
+        con.close()
+
+    def closePool(self, pool):
+        pass
+
+    def secondsBetween(self, start, end):
+        # not strftime('%s'), which would be taken for a placeholder
+        return 'CAST(round((julianday({1}) - julianday({0})) * 86400) AS INTEGER)'.format(start, end)
+
+    def upsertAdd(self, keys, columns):
+        return 'ON CONFLICT(' + ', '.join(keys) + ') DO UPDATE SET ' + \
+               ', '.join('{0} = {0} + excluded.{0}'.format(column) for column in columns)
+
+    def lock(self, cursor, name):
+        return True
+
+    def unlock(self, cursor, name):
+        pass
+
+
+STORAGES = {'mysql': MySQLStorage, 'postgres': PostgresStorage, 'sqlite': SQLiteStorage}
+
+
+def connect(config, backend='mysql'):
+    """
+    Connect to a database with the backend set in its configuration
+
+    :param config: db_config.ini section of the database, as a dictionary
+    :param backend: backend used if the section doesn't set one, one of BACKENDS
+    :return: storage object, with the connection in its con attribute
+    """
+    config = dict(config)
+    return STORAGES[config.pop('backend', backend)](config)
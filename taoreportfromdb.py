@@ -1,11 +1,21 @@
 
 
-import psycopg2
-import mysql.connector
+import copy
+
+import storage
+from reportCache import cached, cacheKey, tableDigest
+
+
+# Queries digested into the data version of cached TAO report results, on Postgres and on MySQL.
+# Jobs are those of the report period (start and end date parameters), so results of a closed quarter stay cached
+TAO_JOBS_VERSION_QUERIES = ("SELECT count(*), max(insertdate), sum(CASE WHEN latestjobversion THEN 1 ELSE 0 END) FROM public.jobs "
+                            "WHERE insertdate BETWEEN Date(%s) AND Date(%s)",)
+TAO_USERS_VERSION_QUERIES = ("SELECT * FROM tao_taouser",)
+
 
 class TAOreport:
 
-    def __init__(self, dbconfig, startdate, enddate):
+    def __init__(self, dbconfig, startdate, enddate, cache=None):
 
         """
         Initialize TAO MySQL and Postgres database connections, report start and end dates
@@ -13,6 +23,7 @@ class TAOreport:
         :param dbconfig: a dictionary of dictionaries, all database configurations
         :param startdate: report start date, start of quarter
         :param enddate: report start date, end of quarter
+        :param cache: ReportCache query results are read from and stored in, None to always query
         """
 
         try:
@@ -22,13 +33,19 @@ class TAOreport:
             # TAO MySQL database configuration from dbconfig dictionary
             mysqldb = dbconfig['tao-mysql']
 
-            # connect to Postgres database
-            self.pgconn = psycopg2.connect(**postgresdb)
+            # connect to Postgres database, unless its configuration sets another storage backend
+            self.pgstorage = storage.connect(postgresdb, 'postgres')
+            self.pgconn = self.pgstorage.con
             self.pgcursor = self.pgconn.cursor()
 
             # connect to MySQL database
-            self.mysqlcon = mysql.connector.connect(**mysqldb)
+            self.mysqlstorage = storage.connect(mysqldb)
+            self.mysqlcon = self.mysqlstorage.con
             self.mysqlcursor = self.mysqlcon.cursor()
+
+            # pools of connections of the copies of the report run by threads, see openPool
+            self.pgpool = None
+            self.mysqlpool = None
             print('connected to DB')
 
             # TAO admin users, to be discarded from Stats
@@ -36,13 +53,16 @@ class TAOreport:
             self.startdate = startdate
             self.enddate = enddate
 
+            self.cache = cache
+            self.version = None
+
             print(startdate)
             print(enddate)
 
             print('Connected')
 
 
-        except psycopg2.DatabaseError as err:
+        except storage.Error as err:
             print(err)
             raise(err)
 
@@ -50,18 +70,76 @@ class TAOreport:
     def finalize(self):
 
         """
-        Close database connections
+        Close database connections, and the pools of copies if opened
         :return: None
         """
 
         self.pgcursor.close()
         self.pgconn.close()
+        if self.pgpool is not None:
+            self.pgstorage.closePool(self.pgpool)
+            self.pgpool = None
         print('Postgres Connection closed')
 
         self.mysqlcursor.close()
         self.mysqlcon.close()
+        if self.mysqlpool is not None:
+            self.mysqlstorage.closePool(self.mysqlpool)
+            self.mysqlpool = None
         print('MySQL Connection closed')
 
+    def openPool(self, size):
+        """
+        Open the pools of Postgres and MySQL connections used by copies of the report returned by fork
+
+        :param size: no of connections of each database, the most copies used at a time
+        :return: None
+        """
+        if self.pgpool is not None:
+            self.pgstorage.closePool(self.pgpool)
+        if self.mysqlpool is not None:
+            self.mysqlstorage.closePool(self.mysqlpool)
+        self.pgpool = self.pgstorage.pool(size)
+        self.mysqlpool = self.mysqlstorage.pool(size)
+
+    def fork(self):
+        """
+        Copy of the report querying on its own connections from the pools, so queries of a thread
+        run concurrently with those of other threads
+
+        :return: TAOreport object, to be released once done
+        """
+        report = copy.copy(self)
+        report.pgconn = self.pgstorage.getConnection(self.pgpool)
+        report.pgcursor = report.pgconn.cursor()
+        report.mysqlcon = self.mysqlstorage.getConnection(self.mysqlpool)
+        report.mysqlcursor = report.mysqlcon.cursor()
+        return report
+
+    def release(self):
+        """
+        Return the connections of a report returned by fork to the pools
+        :return: None
+        """
+        self.pgcursor.close()
+        self.pgstorage.putConnection(self.pgpool, self.pgconn)
+        self.mysqlcursor.close()
+        self.mysqlstorage.putConnection(self.mysqlpool, self.mysqlcon)
+
+    def cacheVersion(self):
+        """
+        Data version of the report, identifying its cached results: period, admins and a digest of the TAO tables.
+        Computed on first use
+
+        :return: hex digest
+        """
+        if self.version is None:
+            self.version = cacheKey(self.startdate, self.enddate, self.adminusers,
+                                    tableDigest(self.pgcursor, TAO_JOBS_VERSION_QUERIES, (self.startdate, self.enddate)),
+                                    tableDigest(self.mysqlcursor, TAO_USERS_VERSION_QUERIES))
+        return self.version
+
+    @cached
     def getnoofjobs(self):
         """
         Get total no of jobs during quarter from Postgres DB
@@ -85,6 +163,7 @@ class TAOreport:
         # print(str.format("total no of jobs: {0}", noofjobs))
         return noofjobs
 
+    @cached
     def getregisteredusers(self):
 
         """
@@ -110,6 +189,7 @@ class TAOreport:
         # print("No of registered users: {0}".format(users))
         return users
 
+    @cached
     def getactiveusers(self):
 
         """
@@ -134,6 +214,7 @@ class TAOreport:
         # print("No of active users: {0}".format(activeusers))
         return activeusers
 
+    @cached
     def getdatasize(self):
 
         select_datasize = (
@@ -155,6 +236,7 @@ class TAOreport:
         # print("Data size: {0} \nTotal records: {1}".format(datasize, totalrecords))
         return (datasize, totalrecords)
 
+    @cached
     def getjobsbydatabase(self):
         """
         Get total no of jobs for each dataset, non premade datasets detailed